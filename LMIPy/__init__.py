@@ -9,6 +9,10 @@ from .dataset import Dataset
 from .geometry import Geometry
 from .collection import Collection
 from .table import Table
+from .backup import Archive, Folder, Store
+from .sync import Sync
+from .jobs import Job
+from .watch import Watcher
 from pkg_resources import get_distribution
 
 __version__ = get_distribution('LMIPy').version
\ No newline at end of file
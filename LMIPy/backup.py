@@ -0,0 +1,414 @@
+import os
+import json
+import zlib
+import struct
+import hashlib
+import datetime
+import threading
+from .utils import updated_signature
+
+CHILD_KEYS = ['layer', 'widget', 'metadata', 'vocabulary']
+
+def backup_path(path=None, archive=False, versioned=False):
+    """
+    Returns the path to save backups to, creating a date-referenced folder (or archive name)
+    inside ./LMI-BACKUP if no path is given. If `archive` (or `versioned`) is True, the Archive (or
+    Store) extension is added to a path which does not end with it. Versioned backups default to a single Store,
+    ./LMI-BACKUP/versions.lmistore, which holds every snapshot.
+    """
+    if not path:
+        path = './LMI-BACKUP'
+        if not os.path.isdir(path):
+            os.mkdir(path)
+        if versioned:
+            return path + f'/versions{Store.extension}'
+        today = datetime.datetime.today().strftime('%Y-%m-%d@%Hh-%Mm')
+        path += f'/{today}'
+    if archive and not path.endswith(Archive.extension):
+        path += Archive.extension
+    if versioned and not path.endswith(Store.extension):
+        path += Store.extension
+    if not path.endswith(Archive.extension) and not path.endswith(Store.extension) and not os.path.isdir(path):
+        os.mkdir(path)
+    return path
+
+def open_backup(path, snapshot=None):
+    """
+    Returns an Archive if the path is an archive file, a Store (at its latest snapshot, or the given
+    `snapshot`) if it is a versioned store, otherwise a Folder of JSON files.
+    """
+    if path.endswith(Archive.extension):
+        return Archive(path)
+    if path.endswith(Store.extension):
+        return Store(path, snapshot=snapshot)
+    return Folder(path)
+
+FACET_KEYS = ['provider', 'connectorType', 'application', 'env', 'published', 'protected', 'status']
+
+def summary(record):
+    """Returns the attributes of a dataset record which are kept in an Archive index for facet counts."""
+    attributes = record.get('attributes', {}) or {}
+    return {k: attributes.get(k, None) for k in FACET_KEYS}
+
+def signature(record):
+    """
+    Returns a short hash of the updatedAt values of a saved dataset record and its children.
+    """
+    attributes = record.get('attributes', {}) or {}
+    return hashlib.sha1(json.dumps(updated_signature(attributes)).encode()).hexdigest()
+
+
+class Folder:
+    """
+    A backup folder holding one JSON file per dataset record.
+
+    The folder is created by the first `append`; reading a folder which does not exist raises FileNotFoundError.
+
+    Parameters
+    ----------
+    path: str
+        Path of the folder.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.type = 'Folder'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Backup Folder {self.path} ({len(self)} records)"
+
+    def __len__(self):
+        return len(self.ids())
+
+    def __contains__(self, record_id):
+        return os.path.exists(f"{self.path}/{record_id}.json")
+
+    def __iter__(self):
+        return (self.get(record_id) for record_id in self.ids())
+
+    def __getitem__(self, record_id):
+        return self.get(record_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def ids(self):
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(f'No backup folder at {self.path}')
+        return sorted([f[:-5] for f in os.listdir(self.path) if f.endswith('.json')])
+
+    def get(self, record_id):
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(f'No backup folder at {self.path}')
+        if record_id not in self:
+            raise KeyError(f'No record {record_id} in {self.path}')
+        with open(f"{self.path}/{record_id}.json") as fp:
+            return json.load(fp)
+
+    def signature(self, record_id):
+        if record_id not in self:
+            return None
+        return signature(self.get(record_id))
+
+    def append(self, record):
+        os.makedirs(self.path, exist_ok=True)
+        with open(f"{self.path}/{record['id']}.json", 'w') as fp:
+            json.dump(record, fp)
+
+    def close(self):
+        pass
+
+
+class Archive:
+    """
+    A single-file backup of dataset records.
+
+    Each record is stored as an individually zlib-compressed JSON frame, followed by a compressed
+    index of {id: [offset, length, signature, summary]} and a fixed-size footer pointing to the index.
+    Records can be appended, read by id without decompressing the rest of the file, or streamed.
+    Facets of the summary keys (FACET_KEYS) are counted from the index alone.
+    Appending a record with an existing id supersedes the earlier copy.
+
+    Parameters
+    ----------
+    path: str
+        Path of the archive file (ending in '.lmi').
+    """
+    extension = '.lmi'
+    header = b'LMIARCH1'
+    footer = struct.Struct('>QQ8s')
+
+    def __init__(self, path):
+        self.path = path
+        self.type = 'Archive'
+        self.lock = threading.Lock()
+        self.fp = None
+        self.index, self.end = self.read_index()
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Backup Archive {self.path} ({len(self)} records)"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, record_id):
+        return record_id in self.index
+
+    def __iter__(self):
+        """Streams the current records in the order they were written."""
+        current = {v[0] for v in self.index.values()}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(len(self.header))
+            while f.tell() < self.end:
+                offset = f.tell()
+                length = struct.unpack('>I', f.read(4))[0]
+                frame = f.read(length)
+                if offset in current:
+                    yield json.loads(zlib.decompress(frame))
+
+    def __getitem__(self, record_id):
+        return self.get(record_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def ids(self):
+        return list(self.index.keys())
+
+    def read_index(self):
+        """Reads the index from the footer, or rebuilds it by scanning the frames if the file was not closed."""
+        if not os.path.exists(self.path):
+            return {}, len(self.header)
+        with open(self.path, 'rb') as f:
+            if f.read(len(self.header)) != self.header:
+                raise ValueError(f'{self.path} is not an LMIPy archive.')
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            if size >= len(self.header) + self.footer.size:
+                f.seek(size - self.footer.size)
+                index_offset, index_length, magic = self.footer.unpack(f.read(self.footer.size))
+                if magic == self.header:
+                    f.seek(index_offset)
+                    return json.loads(zlib.decompress(f.read(index_length))), index_offset
+            index = {}
+            f.seek(len(self.header))
+            while True:
+                offset = f.tell()
+                length_bytes = f.read(4)
+                if len(length_bytes) < 4:
+                    break
+                frame = f.read(struct.unpack('>I', length_bytes)[0])
+                try:
+                    record = json.loads(zlib.decompress(frame))
+                except (zlib.error, ValueError):
+                    break
+                index[record['id']] = [offset, len(frame) + 4, signature(record), summary(record)]
+            return index, offset
+
+    def get(self, record_id):
+        if record_id not in self.index:
+            raise KeyError(f'No record {record_id} in {self.path}')
+        offset, length = self.index[record_id][:2]
+        with open(self.path, 'rb') as f:
+            f.seek(offset + 4)
+            return json.loads(zlib.decompress(f.read(length - 4)))
+
+    def signature(self, record_id):
+        return self.index.get(record_id, [None, None, None])[2]
+
+    def facets(self, fields):
+        """
+        Counts the values of the dataset fields in the archive, from the index if all fields are in
+        FACET_KEYS, otherwise by streaming the records.
+        """
+        from .catalogue import facets
+        if all([f in FACET_KEYS for f in fields]) and all([len(v) > 3 for v in self.index.values()]):
+            return facets([{'attributes': v[3]} for v in self.index.values()], fields)
+        return facets(self, fields)
+
+    def append(self, record):
+        """Appends a record to the archive. The index is written when the archive is closed."""
+        frame = zlib.compress(json.dumps(record).encode())
+        with self.lock:
+            if not self.fp:
+                self.fp = open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b')
+                self.fp.write(self.header)
+                self.fp.seek(self.end)
+                self.fp.truncate()
+            self.index[record['id']] = [self.end, len(frame) + 4, signature(record), summary(record)]
+            self.fp.write(struct.pack('>I', len(frame)) + frame)
+            self.end += len(frame) + 4
+
+    def close(self):
+        """Writes the index and footer after any appended records."""
+        with self.lock:
+            if not self.fp:
+                return
+            index = zlib.compress(json.dumps(self.index).encode())
+            self.fp.write(index)
+            self.fp.write(self.footer.pack(self.end, len(index), self.header))
+            self.fp.close()
+            self.fp = None
+
+
+class Store:
+    """
+    A versioned, content-addressed backup of dataset records.
+
+    Every dataset and child entity (layer, widget, metadata, vocabulary) is stored once as a zlib-compressed
+    blob named by the sha1 of its content, under blobs/. Each save writes a manifest to snapshots/ which
+    points every dataset id at its blobs, so entities which did not change between snapshots cost no new
+    bytes, and any snapshot can be read back.
+
+    A new snapshot starts from the records of the latest one; records appended to it replace those with
+    the same id, records not retained (see `retain`) are left out, and its manifest is written when the
+    store is closed.
+
+    Parameters
+    ----------
+    path: str
+        Path of the store directory (ending in '.lmistore').
+    snapshot: str
+        Name of the snapshot to read. Defaults to the latest snapshot.
+    """
+    extension = '.lmistore'
+
+    def __init__(self, path, snapshot=None):
+        self.path = path
+        self.type = 'Store'
+        self.lock = threading.Lock()
+        self.changed = False
+        for folder in [path, f'{path}/blobs', f'{path}/snapshots']:
+            if not os.path.isdir(folder):
+                os.mkdir(folder)
+        names = self.snapshots()
+        if snapshot and snapshot not in names:
+            raise ValueError(f'No snapshot {snapshot} in {path}. Available snapshots: {names}')
+        self.snapshot = snapshot or (names[-1] if names else None)
+        self.index = self.read_manifest(self.snapshot) if self.snapshot else {}
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Backup Store {self.path} ({len(self.snapshots())} snapshots, {len(self)} records at {self.snapshot})"
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, record_id):
+        return record_id in self.index
+
+    def __iter__(self):
+        return (self.get(record_id) for record_id in self.ids())
+
+    def __getitem__(self, record_id):
+        return self.get(record_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def ids(self):
+        return sorted(self.index.keys())
+
+    def snapshots(self):
+        """Returns the names of the snapshots in the store, oldest first."""
+        return sorted([f[:-5] for f in os.listdir(f'{self.path}/snapshots') if f.endswith('.json')])
+
+    def read_manifest(self, snapshot):
+        with open(f'{self.path}/snapshots/{snapshot}.json') as fp:
+            return json.load(fp)['records']
+
+    def blob_path(self, sha):
+        return f'{self.path}/blobs/{sha[:2]}/{sha}'
+
+    def put_blob(self, document):
+        """Writes a document as a blob, unless a blob with the same content exists, and returns its hash."""
+        data = json.dumps(document, sort_keys=True).encode()
+        sha = hashlib.sha1(data).hexdigest()
+        path = self.blob_path(sha)
+        if not os.path.exists(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.{threading.get_ident()}.tmp', 'wb') as fp:
+                fp.write(zlib.compress(data))
+            os.replace(f'{path}.{threading.get_ident()}.tmp', path)
+        return sha
+
+    def get_blob(self, sha):
+        with open(self.blob_path(sha), 'rb') as fp:
+            return json.loads(zlib.decompress(fp.read()))
+
+    def get(self, record_id):
+        if record_id not in self.index:
+            raise KeyError(f'No record {record_id} in {self.path} at snapshot {self.snapshot}')
+        entry = self.index[record_id]
+        attributes = self.get_blob(entry['blob'])
+        for key, shas in entry['children'].items():
+            attributes[key] = [self.get_blob(sha) for sha in shas]
+        return {'id': record_id, 'type': entry['type'], 'server': entry['server'], 'attributes': attributes}
+
+    def signature(self, record_id):
+        return self.index.get(record_id, {}).get('signature', None)
+
+    def facets(self, fields):
+        """Counts the values of the dataset fields at the current snapshot, from the manifest if all fields are in FACET_KEYS."""
+        from .catalogue import facets
+        if all([f in FACET_KEYS for f in fields]):
+            return facets([{'attributes': v['summary']} for v in self.index.values()], fields)
+        return facets(self, fields)
+
+    def append(self, record):
+        """Stores the entities of a record and adds it to a new snapshot, which is written when the store is closed."""
+        attributes = record.get('attributes', {}) or {}
+        entry = {
+            'type': record.get('type', 'dataset'),
+            'server': record.get('server', None),
+            'blob': self.put_blob({k:v for k,v in attributes.items() if k not in CHILD_KEYS}),
+            'children': {key: [self.put_blob(child) for child in attributes[key] or []] for key in CHILD_KEYS if key in attributes},
+            'signature': signature(record),
+            'summary': summary(record)
+        }
+        with self.lock:
+            self.start_snapshot()
+            self.index[record['id']] = entry
+
+    def start_snapshot(self):
+        if not self.changed:
+            self.snapshot = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H-%M-%S.%f')
+            self.changed = True
+
+    def retain(self, record_ids):
+        """Removes every record not in `record_ids` from the new snapshot, e.g. datasets no longer in a saved Collection."""
+        with self.lock:
+            removed = [record_id for record_id in self.index if record_id not in set(record_ids)]
+            if removed:
+                self.start_snapshot()
+            for record_id in removed:
+                del self.index[record_id]
+
+    def close(self):
+        """Writes the manifest of the new snapshot, if any records were appended."""
+        with self.lock:
+            if not self.changed:
+                return
+            manifest = {'snapshot': self.snapshot, 'records': self.index}
+            with open(f'{self.path}/snapshots/{self.snapshot}.json', 'w') as fp:
+                json.dump(manifest, fp)
+            self.changed = False
@@ -0,0 +1,382 @@
+import requests
+import pandas as pd
+from copy import deepcopy
+from time import monotonic
+from .layer import Layer
+from .utils import CREATE_KEYS, run_concurrently, list_entities, env_association, link_index, update_entity
+from .catalogue import Graph, entities, field_diff
+
+PROVIDER_TIMEOUTS = {'cartodb': 30, 'gee': 30, 'leaflet': 10, 'mapbox': 10}
+
+def sample_tile(url, z=0, x=0, y=0):
+    """Fills in the {z}/{x}/{y} (and {s} subdomain) placeholders of a tile url template."""
+    return url.replace('{z}', str(z)).replace('{x}', str(x)).replace('{y}', str(y)).replace('{s}', 'a')
+
+def check_layer(layer, timeouts=PROVIDER_TIMEOUTS, default_timeout=15):
+    """
+    Resolves the tile url of a Layer and requests one sample tile from it.
+
+    Returns a dictionary describing the result, with status 'ok', 'broken' or 'unsupported'
+    (for layers without a tile url, e.g. vector layers).
+    """
+    provider = layer.attributes.get('provider', None)
+    timeout = timeouts.get(provider, default_timeout)
+    result = {
+        'id': layer.id,
+        'name': layer.attributes.get('name', None),
+        'dataset': layer.attributes.get('dataset', None),
+        'provider': provider,
+        'status': 'ok',
+        'http_status': None,
+        'error': None,
+        'tile_url': None,
+        'seconds': None
+    }
+    start = monotonic()
+    try:
+        url = layer.parse_map_url(timeout=timeout)
+        if not url:
+            result['status'] = 'unsupported'
+        else:
+            result['tile_url'] = sample_tile(url)
+            r = requests.get(result['tile_url'], timeout=timeout)
+            result['http_status'] = r.status_code
+            if r.status_code not in [200, 204]:
+                result['status'] = 'broken'
+    except Exception as e:
+        result['status'] = 'broken'
+        result['error'] = str(e)
+    result['seconds'] = round(monotonic() - start, 3)
+    return result
+
+def health_check(layers, workers=16, timeouts=PROVIDER_TIMEOUTS, mapbox_token=None, only_broken=True):
+    """
+    Checks that layers render by resolving their tile urls and requesting one sample tile each,
+    using up to `workers` concurrent checks and a per-provider timeout in seconds.
+
+    `layers` may be a Collection, or a list of Layer objects or Collection items. Returns a pandas
+    DataFrame with one row per layer (only the broken layers if `only_broken` is True).
+    """
+    def check(item):
+        if type(item) == dict:
+            item = Layer(id_hash=item['id'], attributes=deepcopy(item['attributes']), server=item['server'],
+                         mapbox_token=mapbox_token or item.get('mapbox_token', None))
+        else:
+            item = Layer(id_hash=item.id, attributes=deepcopy(item.attributes), server=item.server,
+                         mapbox_token=mapbox_token or item.mapbox_token)
+        return check_layer(item, timeouts=timeouts)
+    items = [item for item in layers if (item.get('type', None) if type(item) == dict else item.type) == 'Layer']
+    rows = [result for result, error in run_concurrently(check, items, workers=workers)]
+    df = pd.DataFrame(rows, columns=['id', 'name', 'dataset', 'provider', 'status', 'http_status', 'error', 'tile_url', 'seconds'])
+    if only_broken:
+        df = df[df['status'] == 'broken'].reset_index(drop=True)
+    return df
+
+def fetch_entity(server, entity_type, entity_id):
+    """Fetches the attributes of a dataset, layer or widget by id."""
+    r = requests.get(f'{server}/v1/{entity_type}/{entity_id}', headers={'Cache-Control': 'no-cache'})
+    if r.status_code != 200:
+        raise ValueError(f'Unable to get {entity_type} {entity_id} ({r.status_code})')
+    return r.json()['data']['attributes']
+
+def entity_records(items, entity_type='dataset', server='https://api.resourcewatch.org', workers=8):
+    """
+    Returns a list of {'type', 'id', 'server', 'attributes'} records for the datasets, layers and widgets
+    in `items`: a Collection, a list of Collection items or LMIPy objects, or a list of ids of `entity_type`.
+    Records without attributes (e.g. bare ids) are fetched concurrently.
+    """
+    records = []
+    for item in items:
+        if type(item) == str:
+            records.append({'type': entity_type, 'id': item, 'server': server, 'attributes': None})
+        elif type(item) == dict:
+            records.append({'type': item['type'].lower().replace('table', 'dataset'), 'id': item['id'],
+                            'server': item.get('server', server), 'attributes': item.get('attributes', None)})
+        else:
+            records.append({'type': item.type.lower().replace('table', 'dataset'), 'id': item.id,
+                            'server': item.server, 'attributes': item.attributes})
+    records = [r for r in records if r['type'] in ['dataset', 'layer', 'widget']]
+    missing = [r for r in records if not r['attributes']]
+    results = run_concurrently(lambda r: fetch_entity(r['server'], r['type'], r['id']), missing, workers=workers, progress=False)
+    for record, (attributes, error) in zip(missing, results):
+        record['attributes'] = attributes
+        record['error'] = error
+    return records
+
+def patch_payload(attributes, patch, entity_type='dataset'):
+    """
+    Computes the PATCH payload of an entity from a patch spec of {key: value}, locally.
+
+    Keys may be dotted to patch nested values (e.g. 'legendConfig.type'), and values may be callables
+    which receive the current value (None if missing) and return the new one. Keys which cannot be updated
+    (see utils.CREATE_KEYS) are ignored, keys the entity does not have yet are added, and only top-level
+    attributes which actually change are included in the payload.
+    """
+    updatable = {k:v for k,v in attributes.items() if k in CREATE_KEYS[entity_type]}
+    patched = {}
+    for k, v in patch.items():
+        keys = k.split('.')
+        if keys[0] not in CREATE_KEYS[entity_type]:
+            continue
+        if keys[0] not in patched:
+            patched[keys[0]] = deepcopy(updatable.get(keys[0], None))
+        target = patched
+        for key in keys[:-1]:
+            if type(target.get(key, None)) != dict:
+                target[key] = {}
+            target = target[key]
+        target[keys[-1]] = v(target.get(keys[-1], None)) if callable(v) else v
+    return {k:v for k,v in patched.items() if v != updatable.get(k, None)}
+
+def bulk_update(items, patch, token=None, dry_run=True, force=False, workers=8, rate_limit=5,
+                entity_type='dataset', server='https://api.resourcewatch.org'):
+    """
+    Applies a patch spec (see `patch_payload`) to many datasets, layers and widgets.
+
+    `items` may be a Collection, a list of Collection items or LMIPy objects, or a list of ids of
+    `entity_type`. Payloads are computed locally and summarised; unless `dry_run` is True they are then
+    sent concurrently, with up to `workers` requests and at most `rate_limit` requests per second.
+    Protected entities are skipped unless `force` is True.
+
+    Returns a DataFrame with one row per entity, its planned or applied 'status' ('pending', 'unchanged',
+    'protected', 'updated' or 'failed'), the changed fields, and any error.
+    """
+    if not dry_run and not token:
+        raise ValueError(f'[token=None] API TOKEN required for updates.')
+    plan = []
+    for record in entity_records(items, entity_type=entity_type, server=server, workers=workers):
+        attributes = record['attributes'] or {}
+        row = {'id': record['id'], 'type': record['type'], 'name': attributes.get('name', None),
+               'server': record['server'], 'dataset': attributes.get('dataset', None), 'payload': {},
+               'status': 'pending', 'error': record.get('error', None)}
+        if row['error']:
+            row['status'] = 'failed'
+        else:
+            try:
+                row['payload'] = patch_payload(attributes, patch, entity_type=record['type'])
+            except Exception as e:
+                row.update({'status': 'failed', 'error': f'{type(e).__name__}: {e}'})
+            else:
+                if not row['payload']:
+                    row['status'] = 'unchanged'
+                elif attributes.get('protected', False) and not force:
+                    row['status'] = 'protected'
+        plan.append(row)
+    pending = [row for row in plan if row['status'] == 'pending']
+    counts = pd.Series([row['status'] for row in plan], dtype=object).value_counts().to_dict()
+    print(f"{len(pending)} to update, {counts.get('unchanged', 0)} unchanged, "
+          f"{counts.get('protected', 0)} protected (skipped), {counts.get('failed', 0)} failed.")
+    if not dry_run:
+        def send(row):
+            return update_entity(row['server'], row['type'], row['id'], row['payload'], token, dataset_id=row['dataset'])
+        for row, (_, error) in zip(pending, run_concurrently(send, pending, workers=workers, rate_limit=rate_limit)):
+            row['status'] = 'failed' if error else 'updated'
+            row['error'] = str(error) if error else None
+        print(f"Updated {len([row for row in pending if row['status'] == 'updated'])} of {len(pending)}.")
+    df = pd.DataFrame(plan, columns=['id', 'type', 'name', 'dataset', 'status', 'payload', 'error'])
+    df['fields'] = [sorted(p.keys()) for p in df['payload']]
+    return df
+
+DELETE_ORDER = ['membership', 'widget', 'layer', 'metadata', 'vocabulary', 'dataset']
+
+def cascade_plan(records, collections=[]):
+    """
+    Plans the deletion of a list of dataset records (with their nested children) and their children.
+
+    Returns a list of steps {'type', 'id', 'dataset', 'name', 'path'}, where 'path' is the API path to DELETE,
+    ordered leaves first: collection memberships, widgets, layers, metadata, vocabularies, then the datasets.
+    Memberships are found in the given `collections` (Collection objects or API collection documents).
+    """
+    found = entities(records)
+    graph = Graph(found, collections=collections)
+    attributes = {entity_id: atts for (_, entity_id), atts in found.items()}
+    steps = []
+    for record in records:
+        ds_id = record['id']
+        affected = graph.impact(ds_id)
+        for collection_id in affected.get('collection', []):
+            for entity_id in [ds_id] + sorted(graph.children[ds_id]):
+                if collection_id in graph.parents.get(entity_id, set()):
+                    entity_type = graph.nodes[entity_id]
+                    steps.append({'type': 'membership', 'id': f'{collection_id}/{entity_id}', 'dataset': ds_id,
+                                  'name': attributes.get(entity_id, {}).get('name', None),
+                                  'path': f'/v1/collection/{collection_id}/resource/{entity_type}/{entity_id}'})
+        for entity_type in ['widget', 'layer', 'metadata', 'vocabulary']:
+            for entity_id in affected.get(entity_type, []):
+                atts = attributes.get(entity_id, {})
+                app = atts.get('application', None)
+                if entity_type == 'metadata':
+                    path = f"/v1/dataset/{ds_id}/metadata?application={app}&language={atts.get('language', None)}"
+                elif entity_type == 'vocabulary':
+                    path = f"/v1/dataset/{ds_id}/vocabulary/{atts.get('name', None)}?app={app}"
+                else:
+                    path = f'/v1/dataset/{ds_id}/{entity_type}/{entity_id}'
+                steps.append({'type': entity_type, 'id': entity_id, 'dataset': ds_id, 'name': atts.get('name', None), 'path': path})
+        steps.append({'type': 'dataset', 'id': ds_id, 'dataset': ds_id, 'name': attributes.get(ds_id, {}).get('name', None),
+                      'path': f'/v1/dataset/{ds_id}'})
+    return sorted(steps, key=lambda step: DELETE_ORDER.index(step['type']))
+
+def protected_datasets(records):
+    """Returns the ids of the dataset records which are protected, or have a protected layer or widget."""
+    protected = set()
+    for record in records:
+        children = [c for key in ['layer', 'widget'] for c in record['attributes'].get(key, None) or []]
+        if record['attributes'].get('protected', False) or any(c['attributes'].get('protected', False) for c in children):
+            protected.add(record['id'])
+    return protected
+
+def cascade_delete(datasets, token=None, dry_run=True, force=False, workers=8, rate_limit=5, server='https://api.resourcewatch.org',
+                   application=None):
+    """
+    Deletes many datasets together with their layers, widgets, metadata, vocabularies and collection memberships.
+
+    `datasets` may be a list of ids, Dataset objects or Collection items. The dataset trees are fetched
+    concurrently and planned (see `cascade_plan`); the user's collections for `application` (a string or a
+    list; default: the applications of the datasets) are fetched once to find memberships. Protected datasets,
+    and datasets with a protected layer or widget, are left untouched with their whole tree unless `force` is
+    True. Unless `dry_run` is True, the leaves are deleted concurrently with at most `rate_limit` requests per
+    second, then the datasets whose children were all removed.
+
+    Returns a DataFrame with one row per step and its 'status' ('planned', 'protected', 'deleted', 'failed' or 'skipped').
+    """
+    if not token:
+        raise ValueError(f'[token] API token required to delete.')
+    ids = [d if type(d) == str else (d['id'] if type(d) == dict else d.id) for d in datasets]
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+    def fetch(ds_id):
+        r = requests.get(f'{server}/v1/dataset/{ds_id}?includes=layer,widget,metadata,vocabulary', headers=headers)
+        if r.status_code != 200:
+            raise ValueError(f'Unable to get dataset {ds_id} ({r.status_code})')
+        return r.json()['data']
+    results = run_concurrently(fetch, ids, workers=workers, progress=False)
+    for ds_id, (_, error) in zip(ids, results):
+        if error:
+            print(f'Skipping dataset {ds_id}: {error}')
+    records = [{'id': data['id'], 'type': 'dataset', 'attributes': data['attributes']} for data, error in results if not error]
+    if type(application) == str:
+        application = [application]
+    if not application:
+        application = sorted({app for r in records for app in r['attributes'].get('application', None) or []})
+    collections = []
+    if application:
+        r = requests.get(f"{server}/v1/collection?application={','.join(application)}", headers=headers)
+        if r.status_code == 200:
+            collections = r.json().get('data', [])
+    steps = cascade_plan(records, collections=collections)
+    protected = set() if force else protected_datasets(records)
+    for step in steps:
+        step.update({'status': 'protected' if step['dataset'] in protected else 'planned', 'error': None})
+    if protected:
+        print(f"Skipping {len(protected)} protected dataset(s): {', '.join(sorted(protected))}")
+    if not dry_run:
+        def delete(step):
+            r = requests.delete(f"{server}{step['path']}", headers=headers)
+            if r.status_code not in [200, 204]:
+                raise ValueError(f"Deletion of {step['path']} failed ({r.status_code}): {r.text}")
+        leaves = [step for step in steps if step['type'] != 'dataset' and step['status'] == 'planned']
+        for step, (_, error) in zip(leaves, run_concurrently(delete, leaves, workers=workers, rate_limit=rate_limit)):
+            step['status'] = 'failed' if error else 'deleted'
+            step['error'] = str(error) if error else None
+        blocked = {step['dataset'] for step in leaves if step['status'] == 'failed'}
+        roots = [step for step in steps if step['type'] == 'dataset' and step['status'] == 'planned' and step['id'] not in blocked]
+        for step in steps:
+            if step['type'] == 'dataset' and step['status'] == 'planned' and step['id'] in blocked:
+                step['status'] = 'skipped'
+        for step, (_, error) in zip(roots, run_concurrently(delete, roots, workers=workers, rate_limit=rate_limit)):
+            step['status'] = 'failed' if error else 'deleted'
+            step['error'] = str(error) if error else None
+    df = pd.DataFrame(steps, columns=['type', 'id', 'dataset', 'name', 'path', 'status', 'error'])
+    counts = df[df['status'] == ('planned' if dry_run else 'deleted')]['type'].value_counts().to_dict()
+    print(f"{'Planned' if dry_run else 'Deleted'}: " + ', '.join([f'{counts.get(t, 0)} {t}(s)' for t in DELETE_ORDER]))
+    return df
+
+DRIFT_FIELDS = ['layerConfig', 'legendConfig', 'interactionConfig']
+
+def layer_drift(staging, production, fields=DRIFT_FIELDS):
+    """
+    Returns the dotted keys of `fields` which differ between the attributes of a staging layer and
+    its linked production layer.
+    """
+    return sorted(field_diff({f: staging.get(f, None) for f in fields}, {f: production.get(f, None) for f in fields}).keys())
+
+def linked_layer_drift(server='https://api.resourcewatch.org', app='gfw', workers=16, fields=DRIFT_FIELDS, only_drifted=True):
+    """
+    Audits every staging/production pair of layers linked in the layer metadata of an app.
+
+    The associations are fetched once, and both layers of every pair are fetched concurrently (each
+    layer once). Returns a DataFrame with one row per pair, listing the `fields` which differ, the
+    updatedAt of both layers and which one is 'newer'. Pairs where a layer could not be fetched have
+    status 'missing'. Only the pairs which drifted (or are missing) are kept if `only_drifted` is True.
+    """
+    links = env_association(server=server, app=app)
+    layer_ids = sorted(link_index(links).keys())
+    fetched = {}
+    for layer_id, (attributes, error) in zip(layer_ids, run_concurrently(lambda l: fetch_entity(server, 'layer', l), layer_ids, workers=workers)):
+        if not error:
+            fetched[layer_id] = attributes
+    rows = []
+    for link in links:
+        staging, production = fetched.get(link['staging_layer'], None), fetched.get(link['production_layer'], None)
+        row = {**link, 'status': 'missing', 'drift': [], 'staging_updatedAt': None, 'production_updatedAt': None, 'newer': None}
+        if staging and production:
+            row['drift'] = layer_drift(staging, production, fields=fields)
+            row['status'] = 'drifted' if row['drift'] else 'ok'
+            row['staging_updatedAt'], row['production_updatedAt'] = staging.get('updatedAt', None), production.get('updatedAt', None)
+            if row['drift'] and row['staging_updatedAt'] != row['production_updatedAt']:
+                row['newer'] = 'staging' if (row['staging_updatedAt'] or '') > (row['production_updatedAt'] or '') else 'production'
+        rows.append(row)
+    df = pd.DataFrame(rows, columns=['metadata_id', 'staging_layer', 'production_layer', 'status', 'drift',
+                                     'staging_updatedAt', 'production_updatedAt', 'newer'])
+    print(f"{len(df)} linked pair(s): {len(df[df['status'] == 'drifted'])} drifted, {len(df[df['status'] == 'missing'])} missing.")
+    if only_drifted:
+        df = df[df['status'] != 'ok'].reset_index(drop=True)
+    return df
+
+def update_children(entity_type, updates, token=None, server='https://api.resourcewatch.org', workers=8, rate_limit=5):
+    """
+    Updates the vocabularies or metadata of many datasets, with one PATCH request each.
+
+    `updates` is a list of dictionaries holding the 'dataset' id and the attributes to set: 'application',
+    'name' and 'tags' for vocabularies, or 'application', 'language' and 'info' (or other metadata
+    attributes) for metadata. Returns a DataFrame of the updates with their 'status' and any error.
+    """
+    if not token:
+        raise ValueError(f'[token] API token required to update {entity_type}.')
+    def update(item):
+        entity_id = item.get('name', None) if entity_type == 'vocabulary' else None
+        return update_entity(server, entity_type, entity_id, item, token, dataset_id=item['dataset'])
+    rows = []
+    for item, (_, error) in zip(updates, run_concurrently(update, updates, workers=workers, rate_limit=rate_limit)):
+        rows.append({'dataset': item['dataset'], 'application': item.get('application', None),
+                     'name': item.get('name', item.get('language', None)), 'status': 'failed' if error else 'updated',
+                     'error': str(error) if error else None})
+    df = pd.DataFrame(rows, columns=['dataset', 'application', 'name', 'status', 'error'])
+    print(f"Updated {len(df[df['status'] == 'updated'])} {entity_type} entities, {len(df[df['status'] == 'failed'])} failed.")
+    return df
+
+def update_vocabularies(updates, token=None, server='https://api.resourcewatch.org', workers=8, rate_limit=5):
+    """Sets the tags of vocabularies across many datasets. See `update_children`."""
+    return update_children('vocabulary', updates, token=token, server=server, workers=workers, rate_limit=rate_limit)
+
+def update_metadata(updates, token=None, server='https://api.resourcewatch.org', workers=8, rate_limit=5):
+    """Updates the metadata of many datasets, identified by application and language. See `update_children`."""
+    return update_children('metadata', updates, token=token, server=server, workers=workers, rate_limit=rate_limit)
+
+def widget_collection(widgets, server='https://api.resourcewatch.org', name='Widgets'):
+    """Builds an offline Collection of widget documents (as returned by the API), without any requests."""
+    from .collection import Collection
+    resources = [{'type': 'Widget', 'id': w['id'], 'attributes': w['attributes'], 'server': server} for w in widgets]
+    return Collection(attributes={'resources': resources, 'name': name, 'application': None, 'ownerId': None}, server=server)
+
+def export_widgets(app='gfw', server='https://api.resourcewatch.org', env='production', path=None, workers=8,
+                   incremental=True, archive=False, versioned=False, checkpoint=None):
+    """
+    Exports every widget of an app, with its widgetConfig, to a backup folder, Archive or Store.
+
+    The widgets are listed in pages of 1000, and their parent datasets (with all their includes) are each
+    fetched and saved once, concurrently, as in Collection.save. Returns the ids which failed to save, if any.
+    """
+    widgets = list_entities(server, 'widget', app=app, env=env)
+    print(f'Exporting {len(widgets)} widget(s) from {len({w["attributes"].get("dataset", None) for w in widgets})} dataset(s).')
+    col = widget_collection(widgets, server=server, name=f'{app} widgets')
+    return col.save(path=path, workers=workers, incremental=incremental, archive=archive, versioned=versioned, checkpoint=checkpoint)
@@ -0,0 +1,231 @@
+import json
+import hashlib
+from collections import Counter, defaultdict
+from .backup import open_backup, CHILD_KEYS
+
+def entities(source):
+    """
+    Returns a {(type, id): attributes} dictionary of every dataset, layer, widget, metadata and vocabulary
+    in a catalogue snapshot.
+
+    The source may be a Collection, a backup path, a Folder, Archive or Store, or a list of dataset records.
+    Vocabularies are keyed by '<dataset id>/<name>'.
+    """
+    if type(source) == str:
+        source = open_backup(source)
+    if str(type(source)) == "<class 'LMIPy.collection.Collection'>":
+        records = [{'id': item['id'], 'type': item['type'].lower().replace('table', 'dataset'),
+                    'attributes': item.get('attributes', None) or {}} for item in source]
+    else:
+        records = list(source)
+    found = {}
+    for record in records:
+        atts = record.get('attributes', {})
+        found[(record.get('type', 'dataset'), record['id'])] = {k:v for k,v in atts.items() if k not in CHILD_KEYS}
+        for key in CHILD_KEYS:
+            for child in atts.get(key, None) or []:
+                child_atts = child.get('attributes', {})
+                child_id = f"{record['id']}/{child_atts.get('name')}" if key == 'vocabulary' else child['id']
+                found[(key, child_id)] = child_atts
+    return found
+
+def digest(attributes):
+    """Returns a hash of a set of attributes, independent of key order."""
+    return hashlib.sha1(json.dumps(attributes, sort_keys=True, default=str).encode()).hexdigest()
+
+def field_diff(old, new, prefix=''):
+    """
+    Returns {dotted.key: [old, new]} for every value that differs between two (nested) dictionaries.
+    """
+    difs = {}
+    for k in list(old.keys()) + [k for k in new.keys() if k not in old]:
+        a, b = old.get(k, None), new.get(k, None)
+        if type(a) == dict and type(b) == dict:
+            difs.update(field_diff(a, b, prefix=f'{prefix}{k}.'))
+        elif a != b:
+            difs[f'{prefix}{k}'] = [a, b]
+    return difs
+
+def diff(old, new, ignore=[]):
+    """
+    Compares two catalogue snapshots (see `entities` for the accepted sources).
+
+    Returns the 'added', 'removed' and 'changed' entities, the latter with field-level differences.
+    Entities are compared as a whole first, so only those which changed are compared field by field.
+    Keys listed in `ignore` (e.g. ['updatedAt']) are left out of the comparison.
+    """
+    old_entities, new_entities = entities(old), entities(new)
+    def strip(attributes):
+        return {k:v for k,v in attributes.items() if k not in ignore}
+    def summary(key, attributes):
+        return {'type': key[0], 'id': key[1], 'name': attributes.get('name', None)}
+    changed = []
+    for key, atts in new_entities.items():
+        if key in old_entities:
+            old_atts, new_atts = strip(old_entities[key]), strip(atts)
+            if old_atts != new_atts:
+                changed.append({**summary(key, atts), 'fields': field_diff(old_atts, new_atts)})
+    return {
+        'added': [summary(key, atts) for key, atts in new_entities.items() if key not in old_entities],
+        'removed': [summary(key, atts) for key, atts in old_entities.items() if key not in new_entities],
+        'changed': changed
+    }
+
+def facet_value(item, field):
+    """Returns the value of a (dotted) field of a Collection item, looking in its attributes unless it is 'type' or 'server'."""
+    if field in ['type', 'server']:
+        return item.get(field, None)
+    value = item.get('attributes', None) or {}
+    for key in field.split('.'):
+        value = value.get(key, None) if type(value) == dict else None
+    return value
+
+def facets(items, fields):
+    """
+    Counts the values of every field over a list of Collection items in a single pass.
+
+    Values of list fields (e.g. application) are counted once per element. Returns
+    {field: {value: count}} with the values of each field ordered by descending count.
+    """
+    counts = {field: Counter() for field in fields}
+    for item in items:
+        for field in fields:
+            value = facet_value(item, field)
+            if type(value) == list:
+                counts[field].update([v for v in value if type(v) not in [dict, list]])
+            elif type(value) != dict:
+                counts[field][value] += 1
+    return {field: dict(c.most_common()) for field, c in counts.items()}
+
+def source_key(attributes):
+    """
+    Returns a normalised (provider, connectorUrl, tableName) key of a dataset's data source, or None
+    if the dataset has neither a connectorUrl nor a tableName.
+    """
+    url = (attributes.get('connectorUrl', None) or '').strip().lower()
+    for prefix in ['https://', 'http://', 'www.']:
+        url = url[len(prefix):] if url.startswith(prefix) else url
+    table = (attributes.get('tableName', None) or '').strip().lower()
+    if not (url.rstrip('/') or table):
+        return None
+    return ((attributes.get('provider', None) or '').lower(), url.rstrip('/'), table)
+
+def duplicate_sources(source):
+    """
+    Groups the datasets of a catalogue snapshot (see `entities`) which point at the same data source,
+    keyed on their normalised provider, connectorUrl and tableName.
+
+    Returns a list of groups with more than one dataset, largest first. Each dataset lists its number of
+    layers and widgets, to show which copies are in use.
+    """
+    found = entities(source)
+    graph = Graph(found)
+    groups = defaultdict(list)
+    for (entity_type, entity_id), atts in found.items():
+        key = source_key(atts) if entity_type == 'dataset' else None
+        if key:
+            groups[key].append({
+                'id': entity_id,
+                'name': atts.get('name', None),
+                'env': atts.get('env', None),
+                'updatedAt': atts.get('updatedAt', None),
+                'layers': len(graph.neighbours(entity_id, direction='out', entity_type='layer')),
+                'widgets': len(graph.neighbours(entity_id, direction='out', entity_type='widget'))
+            })
+    duplicates = [{'provider': k[0], 'connectorUrl': k[1], 'tableName': k[2], 'datasets': v} for k, v in groups.items() if len(v) > 1]
+    return sorted(duplicates, key=lambda group: -len(group['datasets']))
+
+
+class Graph:
+    """
+    An index of the references between datasets, layers, widgets, metadata, vocabularies and collections.
+
+    Parameters
+    ----------
+    source:
+        A catalogue snapshot (see `entities`) to index.
+    collections: list
+        Collections whose resources are indexed, as Collection objects or API collection documents.
+
+    Adjacency lists are kept in both directions, so the children and parents of an entity are found
+    with a dictionary lookup rather than a request.
+    """
+    def __init__(self, source=None, collections=[]):
+        self.type = 'Graph'
+        self.nodes = {}
+        self.children = defaultdict(set)
+        self.parents = defaultdict(set)
+        if source is not None:
+            self.add(source)
+        for collection in collections:
+            self.add_collection(collection)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Graph ({len(self.nodes)} entities, {sum([len(c) for c in self.children.values()])} references)"
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, entity_id):
+        return entity_id in self.nodes
+
+    def add_edge(self, parent, child):
+        self.children[parent].add(child)
+        self.parents[child].add(parent)
+
+    def add(self, source):
+        """Adds the entities of a catalogue snapshot (or an `entities` dictionary) and their references to their parents."""
+        for (entity_type, entity_id), atts in (source if type(source) == dict else entities(source)).items():
+            self.nodes[entity_id] = entity_type
+            resource = atts.get('resource', None) or {}
+            if entity_type == 'vocabulary':
+                parent = entity_id.split('/')[0]
+            else:
+                parent = resource.get('id', None) or (atts.get('dataset', None) if entity_type != 'dataset' else None)
+            if parent:
+                self.add_edge(parent, entity_id)
+        return self
+
+    def add_collection(self, collection):
+        """Adds a collection and references to the resources it contains."""
+        if str(type(collection)) == "<class 'LMIPy.collection.Collection'>":
+            collection_id, resources = collection.id, collection.attributes['resources']
+        else:
+            collection_id, resources = collection['id'], collection.get('attributes', {}).get('resources', [])
+        self.nodes[collection_id] = 'collection'
+        for resource in resources:
+            self.add_edge(collection_id, resource['id'])
+        return self
+
+    def neighbours(self, entity_id, direction='both', entity_type=None):
+        """
+        Returns the ids of the children ('out'), parents ('in') or both of an entity, optionally only
+        those of one entity type (e.g. 'widget' or 'collection').
+        """
+        found = set()
+        if direction in ['out', 'both']:
+            found |= self.children.get(entity_id, set())
+        if direction in ['in', 'both']:
+            found |= self.parents.get(entity_id, set())
+        return sorted([n for n in found if not entity_type or self.nodes.get(n, None) == entity_type])
+
+    def impact(self, entity_id):
+        """
+        Returns every entity affected by deleting or changing an entity, grouped by type: all of its
+        descendants, and the collections containing it or any of them.
+        """
+        affected = set()
+        pending = [entity_id]
+        while pending:
+            for child in self.children.get(pending.pop(), set()):
+                if child not in affected:
+                    affected.add(child)
+                    pending.append(child)
+        collections = {p for n in affected | {entity_id} for p in self.parents.get(n, set()) if self.nodes.get(p, None) == 'collection'}
+        grouped = defaultdict(list)
+        for n in sorted(affected | collections):
+            grouped[self.nodes.get(n, 'unknown')].append(n)
+        return dict(grouped)
@@ -1,13 +1,16 @@
 import requests
 import random
-import os
 import json
-import datetime
-from tqdm import tqdm
+import pandas as pd
+from functools import partial
 from .dataset import Dataset
 from .table import Table
 from .layer import Layer
-from .utils import html_box, create_class, show, flatten_list, parse_filters, server_uses_widgets
+from .backup import backup_path, open_backup, signature
+from . import catalogue, bulk
+from .sync import Sync
+from .jobs import Job
+from .utils import html_box, create_class, show, flatten_list, parse_filters, match_filters, filter_value, server_uses_widgets, run_concurrently, create_entity, apply_to_entity, dedupe_strings, wait_for_dataset
 
 class Collection:
     """
@@ -30,17 +33,28 @@ class Collection:
         String to search records by, e.g. ’Forest loss’
     object_type: list
         A list of strings of object types to search, e.g. [‘dataset’, ‘layer’]
+    server: str or list
+        The API server to search. If a list of servers is given they are searched concurrently and the
+        results merged, each record keeping the server it was found on.
+    attributes: dict
+        Attributes of a collection ('resources', 'name', 'application', 'ownerId'). These are created
+        as a new collection if a token is given, otherwise they are used as they are.
     filters: dict
         A dictionary of filter key, value pairs e.g. {'provider', 'gee'}
-        Possible search keys: 'connectorType', 'provider', 'status', 'published', 'protected', 'geoInfo'.
+        Server-side search keys: 'connectorType', 'provider', 'status', 'published', 'protected', 'geoInfo',
+        'name', 'env', 'sort' (e.g. '-updatedAt', which replaces order and sort) and 'vocabulary' (a {name: tags} dictionary).
+        Client-side search keys: 'updatedAt' (a (start, end) pair of ISO dates), 'hasLayer' and 'hasWidget'.
     """
+    repr_limit = 25
+
     def __init__(self, id_hash=None, attributes=None, search=None, app=['gfw','rw'], env='production', limit=1000, order='name', sort='desc',
                  object_type=['dataset', 'layer','table', 'widget'], server='https://api.resourcewatch.org',
                  filters=None, mapbox_token=None, token=None):
         self.search = search
         self.type = 'Collection'
         self.search_terms = [search.lower()] + search.lower().strip().split(' ') if search else ''
-        self.server = server
+        self.servers = server if type(server) == list else [server]
+        self.server = self.servers[0]
         self.app = ",".join(app)
         self.env = env
         self.id_hash = id_hash
@@ -57,39 +71,47 @@ class Collection:
             created_collection = self.new_collection(token=token, attributes=attributes)
             self.attributes = created_collection.attributes
             self.id = created_collection.id
-        
+        else:
+            self.attributes = attributes
+
         self.id = id_hash
-        self.iter_position = 0
+        self.backup = None
+        self.snapshot = None
 
     def _repr_html_(self):
-        str_html = ""
-        for n, c in enumerate(self.attributes['resources']):
-            str_html += show(c, n)
-            if n < len(self.attributes['resources'])-1:
-                str_html += '<p></p>'
-        return str_html
+        return self.html()
 
     def __repr__(self):
+        resources = self.attributes['resources']
         rep_string = "["
-        for n, c in enumerate(self.attributes['resources']):
-            rep_string += str(f"{n}. {c['type']} {c['id']} {c['attributes'].get('name', '')}")
-            if n < len(self.attributes['resources'])-1:
+        for n, c in enumerate(resources[:self.repr_limit]):
+            rep_string += str(f"{n}. {c['type']} {c['id']} {c.get('attributes', {}).get('name', '')}")
+            if n < len(resources)-1:
                 rep_string += ',\n '
-        return rep_string
+        if len(resources) > self.repr_limit:
+            rep_string += f'... and {len(resources) - self.repr_limit} more'
+        return rep_string + "]"
+
+    def html(self, start=0, limit=None):
+        """
+        Returns an HTML summary of `limit` resources (Collection.repr_limit by default) from position `start`.
+        It is built from the attributes already held, so no requests are made.
+        """
+        limit = limit or self.repr_limit
+        resources = self.attributes['resources']
+        page = resources[start:start + limit]
+        str_html = '<p></p>'.join([show(c, n) for n, c in enumerate(page, start)])
+        remaining = len(resources) - start - len(page)
+        if remaining > 0:
+            str_html += (f"<p>... and {remaining} more. "
+                         f"Use Collection.html(start={start + len(page)}) to show the next {limit}.</p>")
+        return str_html
 
     def __str__(self):
         return f"Collection {self.id} {self.attributes['name']}"
 
     def __iter__(self):
-        return self
-
-    def __next__(self):
-        if self.iter_position >= len(self.attributes['resources']):
-            self.iter_position = 0
-            raise StopIteration
-        else:
-            self.iter_position += 1
-            return self.attributes['resources'][self.iter_position - 1]
+        return iter(self.attributes['resources'])
 
     def __getitem__(self, key):
         items = self.attributes['resources'][key]
@@ -101,6 +123,106 @@ class Collection:
     def __len__(self):
         return len(self.attributes['resources'])
 
+    def map(self, func, workers=8, kind='thread', progress=True):
+        """
+        Creates the LMIPy object (Dataset, Table, Layer or Widget) for every resource and applies func to it,
+        using up to `workers` threads, or processes if kind='process' (func must then be picklable).
+
+        Returns the results in the order of the resources. If func fails for a resource, the exception
+        is returned in its place.
+        """
+        if kind not in ['thread', 'process']:
+            raise ValueError(f"[kind] must be 'thread' or 'process', not {kind}.")
+        results = run_concurrently(partial(apply_to_entity, func), self, workers=workers, kind=kind, progress=progress)
+        return [error if error else result for result, error in results]
+
+    def to_dataframe(self, columns=None):
+        """
+        Returns a pandas DataFrame of the collection resources, built from the attributes already held.
+
+        Nested attributes are flattened into dot-separated columns (e.g. 'layerConfig.type') and every row
+        carries the id of its parent dataset. A list of `columns` can be given to select a subset.
+        """
+        rows = []
+        for item in self.attributes['resources']:
+            atts = {k:v for k,v in item.get('attributes', {}).items() if k not in ['layer', 'widget', 'metadata', 'vocabulary']}
+            dataset_id = item['id'] if item['type'] in ['Dataset', 'Table'] else atts.get('dataset', None)
+            rows.append({**atts, 'id': item['id'], 'type': item['type'], 'dataset': dataset_id, 'server': item.get('server', self.server)})
+        df = pd.json_normalize(rows, sep='.')
+        if columns:
+            df = df.reindex(columns=columns)
+        return df
+
+    def facets(self, fields=['provider', 'connectorType', 'application', 'env', 'published']):
+        """
+        Counts the values of each field (e.g. 'provider', 'env', 'type' or a dotted 'layerConfig.type')
+        over the resources in a single pass, returning {field: {value: count}}.
+
+        A collection holding exactly the datasets of an Archive or Store (see Collection.load) counts from its index.
+        """
+        backup = open_backup(self.backup, snapshot=self.snapshot) if self.backup else None
+        if (backup and hasattr(backup, 'facets') and sorted(self.object_type) == ['dataset', 'table'] and 'type' not in fields
+                and set(backup.ids()) == {c['id'] for c in self}):
+            return backup.facets(fields)
+        return catalogue.facets(self, fields)
+
+    def graph(self, token=None, collections=[]):
+        """
+        Returns a catalogue.Graph of the references between the entities in the collection.
+
+        Collections can be given to index which of them contain each entity. If a token is given,
+        the collections of that user for the collection's applications are fetched once and indexed.
+        """
+        if token:
+            url = f'{self.server}/v1/collection?application={self.app}'
+            headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+            r = requests.get(url, headers=headers)
+            r.raise_for_status()
+            collections = collections + r.json().get('data', [])
+        return catalogue.Graph(self, collections=collections)
+
+    def health_check(self, workers=16, timeouts=bulk.PROVIDER_TIMEOUTS, only_broken=True):
+        """
+        Checks that the layers in the collection render, requesting one sample tile per layer with up to
+        `workers` concurrent checks and a per-provider timeout. Returns a DataFrame of broken layers
+        (or of all layers if `only_broken` is False).
+        """
+        return bulk.health_check(self, workers=workers, timeouts=timeouts, mapbox_token=self.mapbox_token, only_broken=only_broken)
+
+    def bulk_update(self, patch, token=None, dry_run=True, force=False, workers=8, rate_limit=5):
+        """
+        Applies a patch spec of {dotted.key: value or callable} to every dataset, layer and widget in the
+        collection. Payloads are computed locally and summarised; set dry_run=False to send them
+        concurrently. Protected entities are skipped unless `force` is True. Returns a DataFrame of
+        the planned (or applied) updates.
+        """
+        return bulk.bulk_update(self, patch, token=token, dry_run=dry_run, force=force, workers=workers,
+                                rate_limit=rate_limit, server=self.server)
+
+    def sync(self, target_server, token=None, path=None, env=None, dry_run=False, workers=8, rate_limit=5):
+        """
+        Mirrors the datasets in the collection, with their children, to `target_server`, creating the
+        missing entities and patching the changed ones. The source to target id map is kept in the JSON
+        file at `path`, so repeated syncs are incremental. Returns a DataFrame of the operations.
+        """
+        return Sync(self, target_server, path=path, env=env).run(token=token, dry_run=dry_run, workers=workers, rate_limit=rate_limit)
+
+    def duplicates(self):
+        """
+        Returns groups of datasets in the collection which point at the same data source (normalised
+        provider, connectorUrl and tableName), with the number of layers and widgets of each copy.
+        """
+        return catalogue.duplicate_sources(self)
+
+    def diff(self, other, ignore=[]):
+        """
+        Compares the collection with another catalogue snapshot: a Collection, backup path, Folder, Archive or Store.
+
+        Returns the 'added', 'removed' and 'changed' entities of the collection relative to the other
+        snapshot, with field-level differences for changed entities. Keys listed in `ignore` are not compared.
+        """
+        return catalogue.diff(other, self, ignore=ignore)
+
     def get_collection(self, token=None):
         """
         Getter for the a collection object. In this case dataset and layers
@@ -130,7 +252,10 @@ class Collection:
 
             }
 
-        datasets = self.get_entities()
+        if len(self.servers) > 1:
+            return self.get_federated_collection()
+
+        datasets = [d for d in self.get_entities() if match_filters(d.get('attributes', {}), self.filters)]
         layers = []
         layers = flatten_list([d.get('attributes').get('layer') for d in datasets])
         if server_uses_widgets(server=self.server):
@@ -157,24 +282,52 @@ class Collection:
             'ownerId': None
         }
 
+    def get_federated_collection(self):
+        """
+        Runs the search on every server in Collection.servers concurrently and merges the results, keeping
+        the first record found for each entity in the order the servers were given.
+        """
+        def search(server):
+            try:
+                return Collection(search=self.search, app=self.app.split(','), env=self.env, limit=self.limit,
+                                  order=self.order, sort=self.sort, object_type=self.object_type, server=server,
+                                  filters=self.filters, mapbox_token=self.mapbox_token).attributes['resources']
+            except ValueError:
+                return []
+        merged = {}
+        results = run_concurrently(search, self.servers, workers=len(self.servers), progress=False)
+        for server, (resources, error) in zip(self.servers, results):
+            if error:
+                print(f'Search failed on {server}: {error}')
+                continue
+            for item in resources:
+                merged.setdefault((item['type'], item['id']), item)
+        return {
+            'resources': self.order_results(list(merged.values())),
+            'name': f"Custom Search: '{self.search}'",
+            'application': None,
+            'ownerId': None
+        }
+
     def get_entities(self):
         hash = random.getrandbits(16)
-        filter_string = parse_filters(self.filters)
+        filters = {k:v for k,v in (self.filters or {}).items() if k != 'env'}
+        env = filter_value((self.filters or {}).get('env', self.env))
+        filter_string = parse_filters(filters)
         if server_uses_widgets(server=self.server):
-            url = (f'{self.server}/v1/dataset?app={self.app}{"&filterIncludesByEnv=true" if self.env != "production" else ""}&env={self.env}&{filter_string}'
+            url = (f'{self.server}/v1/dataset?app={self.app}{"&filterIncludesByEnv=true" if env != "production" else ""}&env={env}&{filter_string}'
                    f'includes=layer,vocabulary,metadata,widget&page[size]=1000&hash={hash}')
         else:
-            url = (f'{self.server}/v1/dataset?app={self.app}{"&filterIncludesByEnv=true" if self.env != "production" else ""}&env={self.env}&{filter_string}'
+            url = (f'{self.server}/v1/dataset?app={self.app}{"&filterIncludesByEnv=true" if env != "production" else ""}&env={env}&{filter_string}'
                    f'includes=layer,metadata&page[size]=1000&hash={hash}')
         r = requests.get(url)
         response_list = r.json().get('data', None)
         if not response_list:
             raise ValueError('No items found')
-        return response_list
+        return dedupe_strings(response_list)
 
     def filter_results(self, response_list):
         """Search by a list of strings to return a filtered list of Dataset or Layer objects"""
-        filtered_response = []
         collection = []
         for item in response_list:
             return_layers = 'layer' in self.object_type
@@ -202,8 +355,7 @@ class Collection:
                 slug = slug.lower().split('_')
                 found.append(any([s in slug for s in self.search_terms]))
             if any(found):
-                if len(filtered_response) < self.limit:
-                    filtered_response.append(item)
+                # Records share the attributes of the response rather than copying them
                 if item.get('type') == 'dataset' and item.get('attributes').get('provider') in ['csv', 'json'] and return_tables:
                     collection.append({'type': 'Table','id': item.get('id'), 'attributes': item.get('attributes'), 'server': self.server})
                 elif item.get('type') == 'dataset' and item.get('attributes').get('provider') != ['csv','json'] and return_datasets:
@@ -215,7 +367,18 @@ class Collection:
         return collection
 
     def order_results(self, collection_list):
-        """Operate on a list of objects given the order key, limit, and rule a user has passed"""
+        """
+        Operate on a list of objects given the order key, limit, and rule a user has passed
+
+        If a 'sort' filter (e.g. '-updatedAt') was passed, it takes the place of order and sort, so
+        results merged from several servers keep the server-side order.
+        """
+        sort_filter = (self.filters or {}).get('sort', None)
+        if sort_filter:
+            key = sort_filter.lstrip('-')
+            tmp_sorted = sorted(collection_list, key=lambda c: str((c.get('attributes', None) or {}).get(key, None) or ''),
+                                reverse=sort_filter.startswith('-'))
+            return tmp_sorted[0:self.limit]
         tmp_sorted = []
         try:
             d = {}
@@ -333,138 +496,268 @@ class Collection:
         self.attributes = self.get_collection(token=token)
         return self
 
-    def add_resources(self, token=None, resources=[]):
+    def resource_payloads(self, resources):
+        """
+        Returns {'type', 'id'} payloads for a list of LMIPy objects (Layer, Dataset, Table, or Widget)
+        or Collection items.
+        """
+        valid_resources = {
+            "<class 'LMIPy.layer.Layer'>": "layer",
+            "<class 'LMIPy.dataset.Dataset'>": "dataset",
+            "<class 'LMIPy.table.Table'>": "dataset",
+            "<class 'LMIPy.widget.Widget'>": "widget"
+        }
+        payloads = []
+        for item in resources:
+            if type(item) == dict and item.get('type', '').lower() in ['layer', 'dataset', 'table', 'widget']:
+                payloads.append({'type': item['type'].lower().replace('table', 'dataset'), 'id': item['id']})
+            elif str(type(item)) in valid_resources.keys():
+                payloads.append({'type': valid_resources[str(type(item))], 'id': item.id})
+            else:
+                raise ValueError(f'[resources] list must contain valid LMIPy Layer, Dataset, Table, or Widget objects')
+        return payloads
+
+    def update_resources(self, request, payloads, workers=8, rate_limit=None):
+        """
+        Runs a resource request for each payload concurrently, refreshes the collection once and
+        returns a report of the succeeded and failed payloads.
+        """
+        def send(payload):
+            r = request(payload)
+            if r.status_code != 200:
+                raise ValueError(f'Failed with error code {r.status_code}')
+            return payload
+        report = {'succeeded': [], 'failed': []}
+        for payload, (_, error) in zip(payloads, run_concurrently(send, payloads, workers=workers, rate_limit=rate_limit)):
+            if error:
+                report['failed'].append({**payload, 'error': str(error)})
+            else:
+                report['succeeded'].append(payload)
+        self.report = report
+        return report
+
+    def add_resources(self, token=None, resources=[], workers=8, rate_limit=None):
         """
         Adds new resources to an existing Collection.
         Resources must be a list of valid LMIPy objects (Layer, Dataset, Table, or Widget)
         Requires token.
+
+        Resources are added using up to `workers` concurrent requests and the collection is refreshed once
+        at the end. The per-resource results are kept in Collection.report.
         """
         if not token:
             raise ValueError(f'[token] API token required to add resources to collection.')
         elif not resources:
             raise ValueError(f'[resources] list required to add resources to update collection.')
 
-        valid_resources = {
-            "<class 'LMIPy.layer.Layer'>": "layer",
-            "<class 'LMIPy.dataset.Dataset'>": "dataset",
-            "<class 'LMIPy.table.Table'>": "dataset",
-            "<class 'LMIPy.lmipy.Widget'>": "widget"
-        }
-        
-        if not all([str(type(item)) in valid_resources.keys() for item in resources]):
-            raise ValueError(f'[resources] list must contain valid LMIPy Layer, Dataset, Table, or Widget objects')
-
-        payloads = [
-            {
-                'type': valid_resources[str(type(item))],
-                'id': item.id
-            } for item in resources
-        ]
-
-        for payload in payloads:
-            try:
-                url = f'{self.server}/v1/collection/{self.id}/resource'
-                headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
-                r = requests.post(url, data=json.dumps(payload), headers=headers)
-                if r.status_code == 200:
-                    print(f"{payload['type'].title()} {payload['id']} added to Collection {self.id}.")
-                else:
-                    print(f'Failed with error code {r.status_code}')
-            except:
-                raise ValueError(f'Unable to add resources to collection.')
+        payloads = self.resource_payloads(resources)
+        url = f'{self.server}/v1/collection/{self.id}/resource'
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+        report = self.update_resources(lambda payload: requests.post(url, data=json.dumps(payload), headers=headers),
+                                       payloads, workers=workers, rate_limit=rate_limit)
+        print(f"{len(report['succeeded'])} resource(s) added to Collection {self.id}, {len(report['failed'])} failed.")
 
         self.attributes = self.get_collection(token=token)
         return self
-        
-    def remove_resources(self, token=None, resources=[]):
+
+    def remove_resources(self, token=None, resources=[], workers=8, rate_limit=None):
         """
         Removes new resources from a existing Collection.
         Resources must be a list of valid LMIPy objects (Layer, Dataset, Table, or Widget)
         Requires token.
+
+        Resources are removed using up to `workers` concurrent requests and the collection is refreshed once
+        at the end. The per-resource results are kept in Collection.report.
         """
         if not token:
             raise ValueError(f'[token] API token required to add resources to collection.')
         elif not resources:
             raise ValueError(f'[resources] list required to add resources to update collection.')
 
-        valid_resources = {
-            "<class 'LMIPy.layer.Layer'>": "layer",
-            "<class 'LMIPy.dataset.Dataset'>": "dataset",
-            "<class 'LMIPy.table.Table'>": "dataset",
-            "<class 'LMIPy.lmipy.Widget'>": "widget"
-        }
-        
-        if not all([str(type(item)) in valid_resources.keys() for item in resources]):
-            raise ValueError(f'[resources] list must contain valid LMIPy Layer, Dataset, Table, or Widget objects')
-
-        payloads = [
-            {
-                'type': valid_resources[str(type(item))],
-                'id': item.id
-            } for item in resources
-        ]
-
-        for payload in payloads:
-            try:
-                url = f"{self.server}/v1/collection/{self.id}/resource/{payload['type']}/{payload['id']}"
-                headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
-                r = requests.delete(url, headers=headers)
-                if r.status_code == 200:
-                    print(f"{payload['type'].title()} {payload['id']} removed from Collection {self.id}.")
-                else:
-                    print(f'Failed with error code {r.status_code}')
-            except:
-                raise ValueError(f'Unable to remove resources from collection.')
+        payloads = self.resource_payloads(resources)
+        headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+        report = self.update_resources(lambda payload: requests.delete(f"{self.server}/v1/collection/{self.id}/resource/{payload['type']}/{payload['id']}", headers=headers),
+                                       payloads, workers=workers, rate_limit=rate_limit)
+        print(f"{len(report['succeeded'])} resource(s) removed from Collection {self.id}, {len(report['failed'])} failed.")
 
         self.attributes = self.get_collection(token=token)
         return self
 
-    def save(self, path=None):
+    def save(self, path=None, workers=8, incremental=True, archive=False, versioned=False, checkpoint=None):
         """
         Save all entities in the collection to a local path.
+
+        Each parent dataset is saved once, from the server its items were found on, using up to `workers`
+        concurrent requests. Datasets already held with all their includes are written without being fetched
+        again. If `incremental` is True, datasets whose saved copy in `path` has the same updatedAt values are
+        skipped.
+
+        If `archive` is True, or the path ends in '.lmi', datasets are saved to a single compressed Archive
+        file instead of a folder of JSON files. If `versioned` is True, or the path ends in '.lmistore', they
+        are saved as a new snapshot of a content-addressed Store (see Collection.load(snapshot=...)). When a
+        path is given, the snapshot holds exactly the datasets of the collection, those which failed to save
+        keeping their previous copy; the default ./LMI-BACKUP store is shared, so nothing is removed from it.
+
+        If a `checkpoint` file path is given, saved datasets are recorded in it, failed saves are retried,
+        and a save which stopped half-way resumes with the datasets not saved yet. The checkpoint is cleared
+        once every dataset is saved, so the next save starts afresh.
         """
-        if not path:
-            path = './LMI-BACKUP'
-            if not os.path.isdir(path):
-                os.mkdir(path)
-            today = datetime.datetime.today().strftime('%Y-%m-%d@%Hh-%Mm')
-            path += f'/{today}'
-            if not os.path.isdir(path):
-                os.mkdir(path)
-        else:
-           if not os.path.isdir(path):
-                os.mkdir(path)
+        shared = not path
+        path = backup_path(path, archive=archive, versioned=versioned)
         print(f'Saving to path: {path}')
-        saved = []
+        def includes(server):
+            return "vocabulary,metadata,layer,widget" if server_uses_widgets(server) else "metadata,layer"
+        filtered_includes = (self.filters or {}).get('env', self.env) != 'production'
+
+        def dataset_key(item):
+            server = item.get('server', None) or self.server
+            if item.get('type') in ['Dataset', 'Table']:
+                return (server, item['id'])
+            ds_id = item.get('attributes', {}).get('dataset', None)
+            if not ds_id:
+                r = requests.get(f"{server}/v1/{item['type'].lower()}/{item['id']}")
+                r.raise_for_status()
+                ds_id = r.json()['data']['attributes']['dataset']
+            return (server, ds_id)
+
+        items = list(self)
+        datasets = {}
         failed = []
-        if server_uses_widgets(self.server):
-            url_args = "vocabulary,metadata,layer,widget"
-        else:
-            url_args = "metadata,layer"
-        for item in tqdm(self):
-            if item['id'] not in saved:
-                entity_type = item.get('type')
-                if entity_type in ['Dataset', 'Table']:
-                    ds_id = item['id']
-                else:
-                    ds_id = item['attributes']['dataset']
-                try:
-                    url = f'{self.server}/v1/dataset/{ds_id}?includes={url_args}'
-                    r = requests.get(url)
-                    dataset_config = r.json()['data']
-                except:
-                    failed.append(item)
-
-                save_json = {
-                    "id": ds_id,
-                    "type": "dataset",
-                    "server": self.server,
-                    "attributes": dataset_config['attributes']
-                }
-                with open(f"{path}/{ds_id}.json", 'w') as fp:
-                    json.dump(save_json, fp)
+        for item, (key, error) in zip(items, run_concurrently(dataset_key, items, workers=workers, progress=False)):
+            if error:
+                failed.append(item['id'])
+                continue
+            atts = item.get('attributes', {}) if item['id'] == key[1] else {}
+            held = not filtered_includes and all([k in atts for k in includes(key[0]).split(',')])
+            datasets[key] = atts if held else datasets.get(key, None)
+
+        backup = open_backup(path)
+
+        def save_dataset(key):
+            server, ds_id = key
+            attributes = datasets[key]
+            if not attributes:
+                r = requests.get(f'{server}/v1/dataset/{ds_id}?includes={includes(server)}')
+                r.raise_for_status()
+                attributes = r.json()['data']['attributes']
+            save_json = {
+                "id": ds_id,
+                "type": "dataset",
+                "server": server,
+                "attributes": attributes
+            }
+            if incremental and backup.signature(ds_id) == signature(save_json):
+                return False
+            backup.append(save_json)
+            return True
 
+        keys = list(datasets.keys())
+        with backup:
+            resumed = []
+            if checkpoint:
+                with Job(checkpoint, name=f'save {path}') as job:
+                    results = job.run(save_dataset, keys, key=lambda key: f'{key[0]}/{key[1]}', workers=workers)
+                    resumed = job.resumed
+                    job.complete()
+            else:
+                results = run_concurrently(save_dataset, keys, workers=workers)
+            if backup.type == 'Store' and not shared:
+                backup.retain([ds_id for _, ds_id in keys] + failed)
+        current = [(s, error) for key, (s, error) in zip(keys, results) if f'{key[0]}/{key[1]}' not in resumed]
+        saved = len([s for s, error in current if s])
+        skipped = len([s for s, error in current if s is False and not error])
+        failed += [ds_id for (_, ds_id), (_, error) in zip(keys, results) if error]
+        print(f'Saved {saved} dataset(s), skipped {skipped} unchanged.')
+        if resumed:
+            print(f'{len(resumed)} dataset(s) were already saved by an earlier run.')
         if len(failed) > 0:
             print(f'Some entities failed to save: {failed}')
             return failed
         print('Save complete!')
+
+    @classmethod
+    def load(cls, path, object_type=['dataset', 'layer', 'table', 'widget'], snapshot=None):
+        """
+        Builds a Collection from a backup folder, Archive or Store without making any requests.
+        A Store is read at its latest snapshot, or at the named `snapshot`.
+
+        The datasets held keep their saved layers, widgets, metadata and vocabularies, and can be
+        re-created on a server with Collection.restore().
+        """
+        resources = []
+        server = None
+        for record in open_backup(path, snapshot=snapshot):
+            server = record.get('server', 'https://api.resourcewatch.org')
+            atts = record['attributes']
+            if atts.get('provider') in ['csv', 'json'] and 'table' in object_type:
+                resources.append({'type': 'Table', 'id': record['id'], 'attributes': atts, 'server': server})
+            elif atts.get('provider') not in ['csv', 'json'] and 'dataset' in object_type:
+                resources.append({'type': 'Dataset', 'id': record['id'], 'attributes': atts, 'server': server})
+            for key in ['layer', 'widget']:
+                if key in object_type:
+                    resources += [{'type': key.title(), 'id': c['id'], 'attributes': c['attributes'], 'server': server}
+                                  for c in atts.get(key, None) or []]
+        attributes = {'resources': resources, 'name': f"Backup: '{path}'", 'application': None, 'ownerId': None}
+        col = cls(attributes=attributes, server=server or 'https://api.resourcewatch.org', object_type=object_type)
+        col.backup = path
+        col.snapshot = snapshot
+        return col
+
+    def restore(self, token=None, server=None, workers=4, rate_limit=5, checkpoint=None):
+        """
+        Re-creates the datasets in the collection on a server, along with their saved layers, widgets,
+        metadata and vocabularies.
+
+        All datasets are created first and awaited until saved, then all their children, using up to
+        `workers` concurrent requests and starting at most `rate_limit` creates per second. Returns a report
+        mapping the original ids to the new ids for each entity type, and listing any failures.
+
+        If a `checkpoint` file path is given, the entities created are recorded in it, so a restore which
+        stopped half-way resumes without creating any entity twice. The checkpoint is cleared once the
+        restore succeeds.
+        """
+        if not token:
+            raise ValueError(f'[token] API token required to restore a collection.')
+        if not server: server = self.server
+        datasets = {item['id']: item['attributes'] for item in self if item['type'] in ['Dataset', 'Table']}
+        report = {'dataset': {}, 'layer': {}, 'widget': {}, 'metadata': {}, 'vocabulary': {}, 'failed': []}
+
+        def create(task):
+            entity_type, old_id, attributes, dataset_id = task
+            return create_entity(server, entity_type, attributes, token, dataset_id=dataset_id)
+
+        job = Job(checkpoint, name=f'restore {self.backup or self.id} to {server}') if checkpoint else None
+        def run(tasks):
+            if job:
+                results = job.run(create, tasks, key=lambda task: f'{task[0]}/{task[1]}', workers=workers, rate_limit=rate_limit)
+            else:
+                results = run_concurrently(create, tasks, workers=workers, rate_limit=rate_limit)
+            for (entity_type, old_id, _, _), (new_id, error) in zip(tasks, results):
+                if error:
+                    report['failed'].append({'type': entity_type, 'id': old_id, 'error': str(error)})
+                else:
+                    report[entity_type][old_id] = new_id
+
+        run([('dataset', ds_id, atts, None) for ds_id, atts in datasets.items()])
+        saved = list(report['dataset'].items())
+        waits = run_concurrently(lambda ids: wait_for_dataset(server, ids[1]), saved, workers=workers, progress=False)
+        for (ds_id, _), (_, error) in zip(saved, waits):
+            if error:
+                report['failed'].append({'type': 'dataset', 'id': ds_id, 'error': str(error)})
+        unsaved = {f['id'] for f in report['failed'] if f['type'] == 'dataset'}
+        children = []
+        for ds_id, new_ds_id in report['dataset'].items():
+            if ds_id in unsaved:
+                continue
+            for key in ['layer', 'widget', 'metadata', 'vocabulary']:
+                for child in datasets[ds_id].get(key, None) or []:
+                    child_id = f"{ds_id}/{child['attributes']['name']}" if key == 'vocabulary' else child['id']
+                    children.append((key, child_id, child['attributes'], new_ds_id))
+        run(children)
+        report['vocabulary'] = {k: f"{report['dataset'][k.split('/')[0]]}/{v}" for k, v in report['vocabulary'].items()}
+        if job:
+            if not report['failed']:
+                job.complete()
+            job.close()
+        print(f"Restored {len(report['dataset'])} dataset(s) to {server} with {len(report['failed'])} failure(s).")
+        return report
@@ -2,17 +2,16 @@ import requests
 import json
 import random
 import geopandas as gpd
-import os
-import datetime
 
 #from shapely.geometry import shape
-from time import sleep
 from pprint import pprint
 from .layer import Layer
-from .utils import html_box, nested_set, server_uses_widgets
+from .utils import html_box, nested_set, server_uses_widgets, run_concurrently, create_entity, wait_for_dataset, dataset_record
 from .vocabulary import Vocabulary
 from .metadata import Metadata
 from .widget import Widget
+from .backup import backup_path, open_backup
+from .jobs import Job
 
 
 class Dataset:
@@ -254,7 +253,7 @@ class Dataset:
             print('Deletion aborted.')
         return self
 
-    def clone(self, token=None, env='staging', clone_server=None, dataset_params=None, clone_children=False):
+    def clone(self, token=None, env='staging', clone_server=None, dataset_params=None, clone_children=False, workers=8, timeout=60, checkpoint=None):
         """
         Create a clone of a target Dataset as a new staging or prod Dataset.
         A set of attributes can be specified for the clone Dataset.
@@ -264,10 +263,17 @@ class Dataset:
         Set clone_children=True to clone all child layers, widgets, vocabs and metadata entities.
         Alternatively you may set clone_children as a list containing one or more or 'layer', 'widget', 'vocab', 'meta'
         in order to selectively clone children by entity type.
-        .
+
+        Children are cloned once the new dataset is ready (waiting up to `timeout` seconds), using up to
+        `workers` concurrent requests.
+
+        If a `checkpoint` file path is given, the entities created are recorded in it, so a clone which
+        stopped half-way resumes with the same clone dataset and only creates the missing children. The
+        checkpoint is cleared once the clone succeeds.
         """
         if clone_children == True: clone_children = ['layer', 'widget', 'vocab', 'meta']
         if not clone_server: clone_server = self.server
+        if not dataset_params: dataset_params = {}
         if not token:
             raise ValueError(f'[token] API token required to clone.')
         else:
@@ -293,79 +299,59 @@ class Dataset:
                 del payload['dataset']['tableName']
 
             url = f"{clone_server}/v1/dataset"
-            print(f'Creating clone dataset: {url}')
-            headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
-            r = requests.post(url, data=json.dumps(payload), headers=headers)
-            if r.status_code == 200:
-                clone_dataset_id = r.json()['data']['id']
-                clone_dataset = Dataset(id_hash=clone_dataset_id, server=clone_server)
-            else:
-                print(r.status_code)
-                print(r.text)
-                return None
-            print(f'{clone_server}/dataset/{clone_dataset_id}')
-            if clone_children:
-                # Wait for dataset to be added
-                sleep(0.5)
-                layers =  self.layers
-                if len(layers) > 0 and 'layer' in clone_children:
-                    for l in layers:
-                        try:
-                            layer_name = l.attributes['name']
-
-                            l.clone(token=token, env=env, layer_params={'name': layer_name}, clone_server=clone_server, target_dataset_id=clone_dataset_id)
-                        except:
-                            raise ValueError(f'Layer cloning failed for {l.id}')
-                elif len(layers) == 0:
-                    print("No child layers to clone!")
-                widgets =  self.widget
-                if len(widgets) > 0 and 'widget' in clone_children:
-                    for w in widgets:
-                        widget = w.attributes
-                        widget_payload = {
-                            "name": widget['name'],
-                            "description": widget.get('description', None),
-                            "env": payload['dataset']['env'],
-                            "widgetConfig": widget['widgetConfig'],
-                            "application": payload['dataset']['application']
-                        }
-                        try:
-                            clone_dataset.add_widget(token=token, widget_params=widget_payload)
-                        except:
-                            raise ValueError(f'Widget cloning failed for {widget.id}')
-                elif len(widgets) == 0:
-                    print("No child widgets to clone!")
-                vocabs = self.vocabulary
-                if len(vocabs) > 0 and 'vocab' in clone_children:
-                    for v in vocabs:
-                        vocab = v.attributes
-                        vocab_payload = {
-                            'application': vocab['application'],
-                            'name': vocab['name'],
-                            'tags': vocab['tags']
-                        }
-                        try:
-                            clone_dataset.add_vocabulary(vocab_params=vocab_payload, token=token)
-                        except:
-                            raise ValueError('Failed to clone Vocabulary.')
-                elif len(vocabs) == 0:
-                    print("No child vocabs to clone!")
-                metas = self.metadata
-                if len(metas) > 0 and 'meta' in clone_children:
-                    for m in metas:
-                        meta = m.attributes
-                        meta_payload = {
-                            'application': meta['application'],
-                            'info': meta['info'],
-                            'language': meta['language']
-                        }
-                        try:
-                            clone_dataset.add_metadata(meta_params=meta_payload, token=token)
-                        except:
-                            raise ValueError('Failed to clone Metadata.')
-                elif len(metas) == 0:
-                    print("No child metadata to clone!")
-            # self.attributes = Dataset(clone_dataset_id, server=clone_server).attributes
+            job = Job(checkpoint, name=f'clone {self.id} to {clone_server}') if checkpoint else None
+            def run(func, items, key=str):
+                if job:
+                    return job.run(func, items, key=key, workers=workers)
+                return run_concurrently(func, items, workers=workers, progress=len(items) > 1)
+
+            def create_clone(_):
+                print(f'Creating clone dataset: {url}')
+                headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+                r = requests.post(url, data=json.dumps(payload), headers=headers)
+                if r.status_code != 200:
+                    raise ValueError(f'{r.status_code}\n{r.text}')
+                return r.json()['data']['id']
+            try:
+                clone_dataset_id, error = run(create_clone, ['dataset'])[0]
+                if error:
+                    print(error)
+                    return None
+                print(f'{clone_server}/dataset/{clone_dataset_id}')
+                if clone_children:
+                    wait_for_dataset(clone_server, clone_dataset_id, timeout=timeout)
+                    tasks = []
+                    if len(self.layers) > 0 and 'layer' in clone_children:
+                        tasks += [('layer', l.id, {**l.attributes, 'env': env}) for l in self.layers]
+                    elif len(self.layers) == 0:
+                        print("No child layers to clone!")
+                    if len(self.widget) > 0 and 'widget' in clone_children:
+                        tasks += [('widget', w.id, {**w.attributes, 'env': payload['dataset']['env'],
+                                   'application': payload['dataset']['application']}) for w in self.widget]
+                    elif len(self.widget) == 0:
+                        print("No child widgets to clone!")
+                    if len(self.vocabulary) > 0 and 'vocab' in clone_children:
+                        tasks += [('vocabulary', v.attributes['name'], v.attributes) for v in self.vocabulary]
+                    elif len(self.vocabulary) == 0:
+                        print("No child vocabs to clone!")
+                    if len(self.metadata) > 0 and 'meta' in clone_children:
+                        tasks += [('metadata', m.id, m.attributes) for m in self.metadata]
+                    elif len(self.metadata) == 0:
+                        print("No child metadata to clone!")
+
+                    def clone_child(task):
+                        entity_type, _, attributes = task
+                        attributes = {k:v for k,v in attributes.items() if k != 'protected'}
+                        return create_entity(clone_server, entity_type, attributes, token, dataset_id=clone_dataset_id)
+                    results = run(clone_child, tasks, key=lambda task: f'{task[0]}/{task[1]}')
+                    failed = [f'{entity_type} {child_id}' for (entity_type, child_id, _), (_, error) in zip(tasks, results) if error]
+                    if failed:
+                        raise ValueError(f'Cloning failed for {", ".join(failed)} of clone dataset {clone_dataset_id}')
+                if job:
+                    job.complete()
+            finally:
+                if job:
+                    job.close()
             return Dataset(id_hash=clone_dataset_id, server=clone_server)
 
 
@@ -400,55 +386,32 @@ class Dataset:
             print("Hint: sometimes this service fails due to load on EE servers. Try again.")
             raise ValueError(f'Bad response: {r.status_code} from query: {r.url}')
 
-    def save(self, path=None):
+    def save(self, path=None, archive=False, versioned=False):
         """
         Construct dataset json and save to local path in a date-referenced folder
-        """
-        if not path:
-            path = './LMI-BACKUP'
-            if not os.path.isdir(path):
-                os.mkdir(path)
-            today = datetime.datetime.today().strftime('%Y-%m-%d@%Hh-%Mm')
-            path += f'/{today}'
-            if not os.path.isdir(path):
-                os.mkdir(path)
-        else:
-           if not os.path.isdir(path):
-                os.mkdir(path)
-        if server_uses_widgets(self.server):
-            url_args = "vocabulary,metadata,layer,widget"
-        else:
-            url_args = "metadata,layer"
-        try:
-            url = f"{self.server}/v1/dataset/{self.id}?includes={url_args}"
-            r = requests.get(url)
-            dataset_config = r.json()['data']
-        except:
-            raise ValueError(f'Could not retrieve config.')
 
-        save_json = {
-            "id": self.id,
-            "type": "dataset",
-            "server": self.server,
-            "attributes": dataset_config['attributes']
-        }
-        if not os.path.isdir(path):
-            os.mkdir(path)
-        with open(f"{path}/{self.id}.json", 'w') as fp:
-            json.dump(save_json, fp)
+        If `archive` is True, or the path ends in '.lmi', the dataset is appended to an Archive file instead.
+        If `versioned` is True, or the path ends in '.lmistore', the dataset is saved as a new snapshot of a
+        content-addressed Store, where unchanged entities are not stored again.
+        """
+        path = backup_path(path, archive=archive, versioned=versioned)
+        save_json = dataset_record(self.server, self.id)
+        with open_backup(path) as backup:
+            backup.append(save_json)
         print('Save complete!')
 
 
-    def load(self, path=None, check=True):
+    def load(self, path=None, check=True, snapshot=None):
         """
         From a local backup at the specified path, loads and returns a previous version of the current dataset.
+
+        The path may be a backup folder, an Archive file or a Store, read at its latest snapshot or at `snapshot`.
         """
         if not path:
             print('Requires a file path to valid backup folder.')
             return None
         try:
-            with open(f"{path}/{self.id}.json") as f:
-                recovered_dataset = json.load(f)
+            recovered_dataset = open_backup(path, snapshot=snapshot).get(self.id)
             server = recovered_dataset.get('server', 'https://api.resourcewatch.org')
             if check:
                 blacklist = ['metadata','layer','widget','vocabulary', 'updatedAt']
@@ -460,7 +423,7 @@ class Dataset:
                     print('Loaded attributes != existing attributes')
                     pprint(difs)
         except:
-            raise ValueError(f'Failed to load backup from f{path}/{self.id}.json')
+            raise ValueError(f'Failed to load backup of {self.id} from {path}')
         return Dataset(attributes={**recovered_dataset['attributes'], 'id': recovered_dataset['id']}, server=server)
 
     def add_vocabulary(self, vocab_params=None, token=None):
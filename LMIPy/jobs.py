@@ -0,0 +1,122 @@
+import json
+import sqlite3
+import threading
+from time import sleep
+from .utils import run_concurrently
+
+class Job:
+    """
+    A resumable set of tasks, checkpointed to a SQLite file.
+
+    Each task is identified by a key. Its status ('pending', 'done' or 'failed'), result, error and number
+    of attempts are written to the checkpoint as soon as it finishes, so a job which stops half-way can be
+    run again with the same items and only the tasks which are not done yet are run. Once a job has finished,
+    `complete` retires it so that the next run with the same name starts afresh.
+
+    Parameters
+    ----------
+    path: str
+        Path of the SQLite checkpoint file. Several jobs may share a file.
+    name: str
+        Name of the job within the checkpoint file.
+    """
+    def __init__(self, path, name='job'):
+        self.path = path
+        self.name = name
+        self.type = 'Job'
+        self.lock = threading.Lock()
+        self.resumed = []
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS tasks (job TEXT, key TEXT, status TEXT, result TEXT, error TEXT, '
+                            'attempts INTEGER, PRIMARY KEY (job, key))')
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Job {self.name} in {self.path} {self.status()}"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def status(self):
+        """Returns the number of tasks of the job in each status."""
+        with self.lock:
+            rows = self.db.execute('SELECT status, COUNT(*) FROM tasks WHERE job = ? GROUP BY status', (self.name,)).fetchall()
+        return dict(rows)
+
+    def results(self):
+        """Returns {key: result} for every task of the job which is done."""
+        with self.lock:
+            rows = self.db.execute("SELECT key, result FROM tasks WHERE job = ? AND status = 'done'", (self.name,)).fetchall()
+        return {key: json.loads(result) for key, result in rows}
+
+    def failed(self):
+        """Returns {key: error} for every task of the job which failed."""
+        with self.lock:
+            rows = self.db.execute("SELECT key, error FROM tasks WHERE job = ? AND status = 'failed'", (self.name,)).fetchall()
+        return dict(rows)
+
+    def record(self, key, status, result=None, error=None, attempts=0):
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO tasks VALUES (?, ?, ?, ?, ?, ?)',
+                            (self.name, key, status, json.dumps(result, default=str), error, attempts))
+
+    def reset(self):
+        """Forgets every task of the job, so it starts from scratch when run again."""
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM tasks WHERE job = ?', (self.name,))
+
+    def complete(self):
+        """Retires the job (see `reset`) if every one of its tasks is done, and returns whether it was."""
+        status = self.status()
+        if set(status.keys()) <= {'done'}:
+            self.reset()
+            return True
+        return False
+
+    def run(self, func, items, key=str, workers=8, rate_limit=None, retries=2, backoff=1, progress=True):
+        """
+        Applies func to every item whose task (identified by `key(item)`) is not done yet.
+
+        Tasks run on a pool of up to `workers` threads, starting at most `rate_limit` per second, and a task
+        which raises is retried up to `retries` times, waiting `backoff` seconds and then twice as long each time.
+
+        Returns a list of (result, error) pairs in the same order as `items`, like utils.run_concurrently,
+        with the stored result of the tasks which were done in an earlier run. The keys of those tasks are
+        kept in Job.resumed.
+        """
+        items = list(items)
+        keys = [key(item) for item in items]
+        done = self.results()
+        self.resumed = [k for k in keys if k in done]
+        pending = [(k, item) for k, item in zip(keys, items) if k not in done]
+        if len(pending) < len(items):
+            print(f'Resuming job {self.name}: {len(items) - len(pending)} of {len(items)} task(s) already done.')
+
+        def attempt(task):
+            task_key, item = task
+            for n in range(retries + 1):
+                try:
+                    result = func(item)
+                except Exception as e:
+                    if n == retries:
+                        self.record(task_key, 'failed', error=str(e), attempts=n + 1)
+                        raise
+                    sleep(backoff * 2 ** n)
+                else:
+                    self.record(task_key, 'done', result=result, attempts=n + 1)
+                    return result
+
+        for task_key, _ in pending:
+            self.record(task_key, 'pending')
+        outcomes = dict(zip([k for k, _ in pending], run_concurrently(attempt, pending, workers=workers, rate_limit=rate_limit, progress=progress)))
+        return [(done[k], None) if k in done else outcomes[k] for k in keys]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
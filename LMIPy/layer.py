@@ -6,9 +6,10 @@ import json
 import random
 import re
 from pprint import pprint
-from .utils import html_box, get_geojson_string, nested_set, server_uses_widgets, env_association
+from .utils import html_box, get_geojson_string, nested_set, server_uses_widgets, env_association, link_index
 
 from .metadata import Metadata
+from .backup import open_backup
 
 class Layer:
     """
@@ -19,7 +20,8 @@ class Layer:
     id_hash: int
         An ID hash.
     attributes: dic
-        A dictionary holding the attributes of a dataset.
+        A dictionary holding the attributes of a dataset. If given together with id_hash (and no token),
+        these attributes are used as they are rather than fetched from the server.
     server: str
         A string of the server URL.
     """
@@ -37,6 +39,9 @@ class Layer:
             created_layer = self.new_layer(token=token, attributes=attributes, server=self.server)
             self.attributes = created_layer.attributes
             self.id = created_layer.id
+        elif attributes and id_hash and 'attributes' not in attributes:
+            self.id = id_hash
+            self.attributes = attributes
         elif attributes:
             self.id = attributes.get('id')
             self.attributes = self.get_layer()
@@ -71,9 +76,11 @@ class Layer:
         else:
             raise ValueError(f'Layer with id={self.id} does not exist for server={self.server}.')
 
-    def parse_map_url(self):
+    def parse_map_url(self, timeout=None):
         """
         Parses map urls
+
+        A `timeout` in seconds can be given for the requests needed to instantiate CARTO and Mapbox maps.
         """
         if self.attributes.get('layerConfig') == None:
             raise ValueError("No layerConfig present in layer from which to create a map.")
@@ -85,11 +92,11 @@ class Layer:
             return self.get_ee_tiles()
         # If CARTO
         if self.attributes.get('provider') == 'cartodb':
-            return self.get_carto_tiles()
+            return self.get_carto_tiles(timeout=timeout)
         if self.attributes.get('provider') == 'mapbox':
             if not self.mapbox_token:
                 raise ValueError("Requires a Mapbox Access Token in param: 'mapbox_token'.")
-            return self.get_mapbox_tiles()
+            return self.get_mapbox_tiles(timeout=timeout)
 
     def get_leaflet_tiles(self):
         """
@@ -121,7 +128,7 @@ class Layer:
         url = f'{self.server}/v1/layer/{self.id}/tile/gee/{{z}}/{{x}}/{{y}}'
         return url
 
-    def get_carto_tiles(self):
+    def get_carto_tiles(self, timeout=None):
         """Get carto tiles"""
         sql_config = self.attributes.get('layerConfig').get('sql_config', None)
         layerConfig = self.attributes.get('layerConfig')
@@ -142,7 +149,7 @@ class Layer:
         }))
         apiParams = f"?stat_tag=API&config={_layerTpl}"
         url = f"https://{layerConfig.get('account')}.carto.com/api/v1/map{apiParams}"
-        r = requests.get(url, headers={'Content-Type': 'application/json'})
+        r = requests.get(url, headers={'Content-Type': 'application/json'}, timeout=timeout)
         if r.status_code == 200:
             response = r.json()
         else:
@@ -151,14 +158,14 @@ class Layer:
         tile_url = f'{response["cdn_url"]["templates"]["https"]["url"]}/{layerConfig["account"]}/api/v1/map/{response["layergroupid"]}/{{z}}/{{x}}/{{y}}.png'
         return tile_url
 
-    def get_mapbox_tiles(self):
+    def get_mapbox_tiles(self, timeout=None):
         """"Retrieve mapbox tiles... as raster :("""
         layerConfig = self.attributes['layerConfig']
         vector_target = layerConfig['body'].get('format', None)
         if vector_target and vector_target.lower() == 'mapbox':
             vector_source = layerConfig['body'].get('url', '').split('mapbox://')[1]
             url = f"https://api.mapbox.com/v4/{vector_source}.json?secure&access_token={self.mapbox_token}"
-            r = requests.get(url, headers={'Content-Type': 'application/json'})
+            r = requests.get(url, headers={'Content-Type': 'application/json'}, timeout=timeout)
             if r.status_code == 200:
                 return r.json().get('tiles', [None])[0].replace('vector.pbf', 'png')
             else:
@@ -323,7 +330,6 @@ class Layer:
         The argument `clone_server` specifies the server to clone to. Default server is the layers own server.
         The argument `create_link` will link the clone layer and the original if they are env='staging' and env='production', respectively.
         """
-        from .dataset import Dataset
         if not clone_server: clone_server = self.server
 
         if not token:
@@ -334,9 +340,7 @@ class Layer:
         for k in clone_layer_attr.keys():
             if k in layer_params:
                 clone_layer_attr[k] = layer_params[k]
-        if target_dataset_id:
-            target_dataset = Dataset(id_hash=target_dataset_id, server=clone_server)
-        else:
+        if not target_dataset_id:
             target_dataset = self.dataset()
             clone_dataset_attr = {**target_dataset.attributes, 'name': name, }
             payload = {"dataset":{
@@ -498,12 +502,10 @@ class Layer:
         """
         from .dataset import Dataset
         if not path:
-            print('Requires a file path to valid backup .json file.')
+            print('Requires a file path to valid backup folder or archive.')
             return None
         try:
-            ds = self.dataset()
-            with open(f"{path}/{ds.id}.json") as f:
-                recovered_dataset = json.load(f)
+            recovered_dataset = open_backup(path).get(self.attributes['dataset'])
             layers = recovered_dataset['attributes']['layer']
             server = recovered_dataset.get('server', 'https://api.resourcewatch.org')
             if len(layers) > 0: recovered_layer = [l for l in layers if l['id'] == self.id][0]
@@ -683,18 +685,21 @@ class Layer:
         return metadata_list
 
 
-    def get_linked_layer(self, app='gfw'):
+    def get_linked_layer(self, app='gfw', links=None):
         """
         Searches for corresponding staging/env Layers that have been linked in Layer.metadata
 
         Populates the linked layer id and env in the Object.linked_layer attribute and returns
         the linked layer Layer object.
+
+        An index of links (see utils.link_index) can be passed as `links` to avoid fetching the
+        associations of the app again for every layer.
         """
-        links = env_association(server=self.server, app=app)
-        found_link = [link for link in links if self.id in link.values()]
+        if links is None:
+            links = link_index(env_association(server=self.server, app=app))
+        ids = links.get(self.id, None)
 
-        if found_link and len(found_link):
-            ids = found_link[0]
+        if ids:
 
             production_id = ids.get('production_layer', None)
             staging_id = ids.get('staging_layer', None)
@@ -703,7 +708,7 @@ class Layer:
             isLinkedLayerProdEnv = not (production_id == self.id)
 
             linkId = production_id if isLinkedLayerProdEnv else staging_id
-            linkLayer = Layer(linkId)
+            linkLayer = Layer(linkId, server=self.server)
 
             self.linked_layer = {
                 'id': linkId,
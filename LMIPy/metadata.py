@@ -1,7 +1,6 @@
 import requests
 import random
-import json
-from .utils import html_box, nested_set
+from .utils import html_box, nested_set, update_entity
     
 
 class Metadata:
@@ -34,8 +33,9 @@ class Metadata:
         A single application string and language string ('en' by default) must be specified within the
         `update_params` dictionary, as well as an (optional) info dictionary.
         Info has a free schema.
+
+        The update is a single request, and the Metadata object is updated in place and returned.
         """
-        from .dataset import Dataset
         if not token:
             raise ValueError(f'[token] API token required to update metadata.')
         app = self.attributes.get('application', None)
@@ -48,20 +48,16 @@ class Metadata:
                 "language": lang,
                 "info": info,
             }
-            print('payload',payload)
             try:
-                url = f'{self.server}/v1/dataset/{ds_id}/metadata'
-                print('url',url)
-                headers = {'Authorization': 'Bearer ' + token, 'Content-Type': 'application/json'}
-                r = requests.patch(url, data=json.dumps(payload), headers=headers)
+                updated = update_entity(self.server, 'metadata', self.id, payload, token, dataset_id=ds_id)
+            except ValueError as e:
+                print(e)
+                return None
             except:
                 raise ValueError(f'Metadata update failed.')
-            if r.status_code == 200:
-                print(f'Metadata updated.')
-                return Dataset(id_hash=ds_id, server=self.server).metadata
-            else:
-                print(f'Failed with error code {r.status_code}')
-                return None
+            print(f'Metadata updated.')
+            self.attributes = {**self.attributes, **payload, **updated}
+            return self
         else:
             raise ValueError(f'Metadata update requires info object and application string.')
 
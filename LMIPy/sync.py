@@ -0,0 +1,150 @@
+import os
+import json
+import threading
+import pandas as pd
+from .catalogue import entities, digest, field_diff
+from .utils import CREATE_KEYS, run_concurrently, create_entity, update_entity, wait_for_dataset
+
+class Sync:
+    """
+    Mirrors the datasets of a catalogue snapshot, with their layers, widgets, metadata and vocabularies,
+    to another server.
+
+    A map of source ids to target ids, with a digest and copy of what was last sent for each entity, is kept
+    (and persisted to `path` if given), so repeated syncs only create the entities missing from the target
+    and patch the ones which changed since the last sync.
+
+    Parameters
+    ----------
+    source:
+        A catalogue snapshot: a Collection, a backup path, a Folder, Archive or Store, or a list of dataset records.
+    target_server: str
+        The server to sync to, e.g. 'https://api.resourcewatch.org'.
+    path: str
+        Path of a JSON file holding the id map. If None, the map is only kept in memory.
+    env: str
+        If given, the env of the target entities (e.g. 'production').
+    """
+    def __init__(self, source, target_server, path=None, env=None):
+        self.type = 'Sync'
+        self.source = source
+        self.target_server = target_server
+        self.path = path
+        self.env = env
+        self.lock = threading.Lock()
+        self.map = {}
+        if path and os.path.exists(path):
+            with open(path) as fp:
+                self.map = json.load(fp)
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Sync to {self.target_server} ({len(self.map)} entities mapped)"
+
+    def payload(self, entity_type, attributes):
+        """Returns the attributes of an entity which are sent to the target server."""
+        payload = {k: attributes[k] for k in CREATE_KEYS[entity_type] if k in attributes}
+        if entity_type == 'vocabulary':
+            payload['name'] = attributes.get('name', None)
+        if self.env and 'env' in CREATE_KEYS[entity_type]:
+            payload['env'] = self.env
+        return payload
+
+    def plan(self):
+        """
+        Compares the source with the id map and returns the operations needed, datasets first.
+
+        Each operation has an 'action' ('create', 'update' or 'unchanged'), the entity 'type', the source
+        'id' and 'dataset', the 'target' id if already mapped, the 'payload' to send and the changed 'fields'.
+        """
+        operations = []
+        for (entity_type, entity_id), attributes in entities(self.source).items():
+            payload = self.payload(entity_type, attributes)
+            mapped = self.map.get(f'{entity_type}/{entity_id}', None)
+            if entity_type == 'dataset':
+                dataset_id = entity_id
+            elif entity_type == 'vocabulary':
+                dataset_id = entity_id.split('/')[0]
+            else:
+                dataset_id = attributes.get('dataset', None)
+            operation = {'action': 'create', 'type': entity_type, 'id': entity_id, 'dataset': dataset_id,
+                         'target': None, 'payload': payload, 'fields': sorted(payload.keys())}
+            if mapped:
+                operation['target'] = mapped['id']
+                if mapped['digest'] == digest(payload):
+                    operation.update({'action': 'unchanged', 'fields': []})
+                else:
+                    changed = field_diff(mapped['payload'], payload)
+                    operation.update({'action': 'update', 'fields': sorted({k.split('.')[0] for k in changed})})
+            operations.append(operation)
+        return sorted(operations, key=lambda o: o['type'] != 'dataset')
+
+    def save(self):
+        """Writes the id map to `path`, if given."""
+        if self.path:
+            with self.lock:
+                with open(self.path, 'w') as fp:
+                    json.dump(self.map, fp)
+
+    def run(self, token=None, dry_run=False, workers=8, rate_limit=5, timeout=60):
+        """
+        Creates the missing entities on the target server and patches the changed fields of the others.
+
+        Datasets are synced first, then their children, each group using up to `workers` concurrent
+        requests and starting at most `rate_limit` requests per second. New datasets are awaited (up to
+        `timeout` seconds each) until saved before their children are created. The id map is updated after
+        each entity and saved after each group. Children of datasets which could not be synced are skipped.
+
+        Returns a DataFrame of the operations with their 'status' ('planned', 'done', 'unchanged',
+        'failed' or 'skipped').
+        """
+        if not token and not dry_run:
+            raise ValueError(f'[token] API token required to sync.')
+        operations = self.plan()
+        for operation in operations:
+            operation.update({'status': 'unchanged' if operation['action'] == 'unchanged' else 'planned', 'error': None})
+        if not dry_run:
+            def apply(operation):
+                entity_type, payload = operation['type'], operation['payload']
+                target_dataset = self.map[f"dataset/{operation['dataset']}"]['id'] if entity_type != 'dataset' else None
+                if operation['action'] == 'create':
+                    target_id = create_entity(self.target_server, entity_type, payload, token, dataset_id=target_dataset)
+                else:
+                    target_id = operation['target']
+                    keys = operation['fields'] + (['application', 'language'] if entity_type in ['metadata', 'vocabulary'] else [])
+                    changed = {k: payload[k] for k in keys if k in payload}
+                    update_entity(self.target_server, entity_type, target_id, changed, token, dataset_id=target_dataset)
+                with self.lock:
+                    self.map[f"{entity_type}/{operation['id']}"] = {'id': target_id, 'digest': digest(payload), 'payload': payload}
+                return target_id
+
+            unsaved = set()
+            for group in [[o for o in operations if o['type'] == 'dataset'], [o for o in operations if o['type'] != 'dataset']]:
+                pending = []
+                for operation in group:
+                    if operation['status'] != 'planned':
+                        continue
+                    if operation['type'] != 'dataset' and (f"dataset/{operation['dataset']}" not in self.map or operation['dataset'] in unsaved):
+                        operation['status'] = 'skipped'
+                    else:
+                        pending.append(operation)
+                for operation, (target_id, error) in zip(pending, run_concurrently(apply, pending, workers=workers, rate_limit=rate_limit)):
+                    operation['status'] = 'failed' if error else 'done'
+                    operation['target'] = target_id or operation['target']
+                    operation['error'] = str(error) if error else None
+                created = [o for o in pending if o['type'] == 'dataset' and o['action'] == 'create' and o['status'] == 'done']
+                waits = run_concurrently(lambda o: wait_for_dataset(self.target_server, o['target'], timeout=timeout), created,
+                                         workers=workers, progress=False)
+                for operation, (_, error) in zip(created, waits):
+                    if error:
+                        operation.update({'status': 'failed', 'error': str(error)})
+                        unsaved.add(operation['id'])
+                self.save()
+        df = pd.DataFrame(operations, columns=['action', 'type', 'id', 'dataset', 'target', 'fields', 'status', 'error'])
+        counted = df if dry_run else df[df['status'].isin(['done', 'unchanged'])]
+        counts = counted['action'].value_counts().to_dict()
+        print(f"{'Planned' if dry_run else 'Synced'}: {counts.get('create', 0)} created, {counts.get('update', 0)} updated, "
+              f"{counts.get('unchanged', 0)} unchanged, {len(df[df['status'] == 'failed'])} failed.")
+        return df
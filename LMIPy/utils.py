@@ -1,6 +1,11 @@
 import json
 from shapely.geometry import mapping, shape, box
 import requests
+from urllib.parse import quote
+import threading
+from time import sleep, monotonic
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from tqdm import tqdm
 
 def html_box(item):
     """Returns an HTML block with template strings filled-in based on item attributes."""
@@ -125,16 +130,19 @@ def show_image_collection(item, i):
     return html_string
 
 def show(item, i):
-    """Returns an HTML block with template strings filled-in based on item attributes."""
+    """
+    Returns an HTML block with template strings filled-in based on the attributes held by a Collection item.
+    No requests are made.
+    """
     is_layer = item['type'] == 'Layer'
     is_dataset = item['type'] == 'Dataset'
     is_table = item['type'] == 'Table'
     is_widget = item['type'] == 'Widget'
     server = item['server']
     item_id = item['id']
-    item = create_class(item)
-    attributes = item.attributes
+    attributes = item.get('attributes', None) or {}
     env = attributes.get('env')
+    item_app = attributes.get('application', None) or []
     uses_widgets = server_uses_widgets(server)
     if is_layer:
         kind_of_item = 'Layer'
@@ -155,7 +163,7 @@ def show(item, i):
         else:
             url_link = f'{server}/v1/dataset/{item_id}?filterIncludesByEnv=true&includes=metadata,layer'
     elif is_widget:
-        kind_of_item = 'Table'
+        kind_of_item = 'Widget'
         url_link = f'{server}/v1/widget/{item_id}'
     else:
         kind_of_item = 'Unknown'
@@ -193,9 +201,9 @@ def show(item, i):
             "</a></div><div class='item_right' style='float: none; width: auto; hidden;padding-left: 10px; overflow: hidden;''>"
             f"<b>{i}. </b>"
             f"<a href={url_link} target='_blank'>"
-            f"<b>{attributes.get('name', None)}</b>"
+            f"<b>{attributes.get('name', item_id)}</b>"
             "</a>"
-            f"<br>{attributes.get('env').title()} {kind_of_item} in {', '.join(attributes.get('application', '')).upper()}."
+            f"<br>{(env or '').title()} {kind_of_item} in {', '.join(item_app).upper() if type(item_app) == list else item_app.upper()}."
             f"<br> {table_statement}"
             f"<br>Last Modified: {attributes.get('updatedAt', None)}"
             f"<br><a href='{server}/v1/fields/{item_id}' target='_blank'>Fields</a>"
@@ -227,6 +235,189 @@ def flatten_list(nested_list):
     else:
         return []
 
+class RateLimiter:
+    """
+    Spaces out calls to `wait` so that at most `rate` calls per second go through, across threads.
+    """
+    def __init__(self, rate=None):
+        self.interval = 1 / rate if rate else 0
+        self.next_call = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            sleep(delay)
+
+def run_concurrently(func, items, workers=8, rate_limit=None, progress=True, kind='thread'):
+    """
+    Applies func to every item using a pool of at most `workers` threads (or processes if kind='process'),
+    starting at most `rate_limit` calls per second if given.
+
+    Returns a list of (result, error) pairs in the same order as `items`. Exceptions raised by func
+    are returned as the error of that item instead of being raised.
+    """
+    items = list(items)
+    results = []
+    limiter = RateLimiter(rate_limit)
+    executor_class = ProcessPoolExecutor if kind == 'process' else ThreadPoolExecutor
+    with tqdm(total=len(items), disable=not progress) as bar, executor_class(max_workers=max(1, workers)) as executor:
+        futures = []
+        for item in items:
+            limiter.wait()
+            future = executor.submit(func, item)
+            future.add_done_callback(lambda f: bar.update())
+            futures.append(future)
+        for future in futures:
+            try:
+                results.append((future.result(), None))
+            except Exception as e:
+                results.append((None, e))
+    return results
+
+def wait_for_dataset(server, dataset_id, timeout=60, interval=0.5):
+    """
+    Polls a dataset until its status is 'saved' and returns its attributes. Raises a ValueError if the
+    dataset fails or is not ready within `timeout` seconds.
+    """
+    deadline = monotonic() + timeout
+    while True:
+        r = requests.get(f'{server}/v1/dataset/{dataset_id}', headers={'Cache-Control': 'no-cache'})
+        attributes = r.json().get('data', {}).get('attributes', {}) if r.status_code == 200 else {}
+        status = attributes.get('status', None)
+        if status == 'saved':
+            return attributes
+        if status == 'failed':
+            raise ValueError(f"Dataset {dataset_id} failed: {attributes.get('errorMessage', '')}")
+        if monotonic() + interval > deadline:
+            raise ValueError(f'Dataset {dataset_id} not ready after {timeout} seconds (status={status}).')
+        sleep(interval)
+        interval = min(interval * 2, 5)
+
+def dataset_record(server, dataset_id):
+    """
+    Fetches a dataset with all its includes and returns it as a backup record {"id", "type", "server", "attributes"}.
+    """
+    if server_uses_widgets(server):
+        url_args = "vocabulary,metadata,layer,widget"
+    else:
+        url_args = "metadata,layer"
+    try:
+        url = f"{server}/v1/dataset/{dataset_id}?includes={url_args}"
+        r = requests.get(url)
+        dataset_config = r.json()['data']
+    except:
+        raise ValueError(f'Could not retrieve config.')
+    return {
+        "id": dataset_id,
+        "type": "dataset",
+        "server": server,
+        "attributes": dataset_config['attributes']
+    }
+
+def apply_to_entity(func, item):
+    """Creates the LMIPy object for a Collection item and applies func to it."""
+    return func(create_class(item))
+
+CREATE_KEYS = {
+    'dataset': ['name', 'application', 'connectorType', 'connectorUrl', 'tableName', 'provider', 'published', 'env',
+                'description', 'subtitle', 'geoInfo', 'legend', 'protected', 'widgetRelevantProps', 'layerRelevantProps'],
+    'layer': ['name', 'application', 'applicationConfig', 'description', 'env', 'interactionConfig', 'iso',
+              'layerConfig', 'legendConfig', 'provider', 'published', 'default', 'protected'],
+    'widget': ['name', 'application', 'description', 'env', 'widgetConfig', 'published', 'default', 'protected', 'freeze'],
+    'metadata': ['application', 'language', 'name', 'description', 'source', 'citation', 'license', 'info', 'columns', 'units'],
+    'vocabulary': ['application', 'tags']
+}
+
+def create_entity(server, entity_type, attributes, token, dataset_id=None):
+    """
+    Creates a dataset, or a layer, widget, metadata or vocabulary of `dataset_id`, from a set of
+    attributes and returns the id of the new entity (the name, for vocabularies).
+    """
+    payload = {k:v for k,v in attributes.items() if k in CREATE_KEYS[entity_type] and v is not None}
+    if entity_type == 'dataset':
+        url = f'{server}/v1/dataset'
+        payload = {'dataset': payload}
+    elif entity_type == 'vocabulary':
+        url = f"{server}/v1/dataset/{dataset_id}/vocabulary/{attributes['name']}"
+    else:
+        url = f'{server}/v1/dataset/{dataset_id}/{entity_type}'
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+    r = requests.post(url, data=json.dumps(payload), headers=headers)
+    if r.status_code != 200:
+        raise ValueError(f'Unable to create {entity_type} at {url} ({r.status_code}): {r.text}')
+    if entity_type == 'vocabulary':
+        return attributes['name']
+    data = r.json().get('data')
+    return (data[0] if type(data) == list else data).get('id')
+
+def update_entity(server, entity_type, entity_id, attributes, token, dataset_id=None):
+    """
+    Patches a dataset, or a layer, widget, metadata or vocabulary of `dataset_id`, with the creatable
+    keys (see CREATE_KEYS) in `attributes`, and returns the updated attributes.
+    Metadata are identified by their application and language, and vocabularies by their name (`entity_id`).
+    """
+    payload = {k:v for k,v in attributes.items() if k in CREATE_KEYS[entity_type]}
+    if entity_type == 'dataset':
+        url = f'{server}/v1/dataset/{entity_id}'
+    elif entity_type == 'metadata':
+        url = f'{server}/v1/dataset/{dataset_id}/metadata'
+        payload = {**payload, 'application': attributes.get('application', None), 'language': attributes.get('language', None)}
+    elif entity_type == 'vocabulary':
+        url = f'{server}/v1/dataset/{dataset_id}/vocabulary/{entity_id}'
+        payload = {**payload, 'application': attributes.get('application', None)}
+    else:
+        url = f'{server}/v1/dataset/{dataset_id}/{entity_type}/{entity_id}'
+    headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json', 'Cache-Control': 'no-cache'}
+    r = requests.patch(url, data=json.dumps(payload), headers=headers)
+    if r.status_code != 200:
+        raise ValueError(f'Unable to update {entity_type} at {url} ({r.status_code}): {r.text}')
+    data = r.json().get('data')
+    return (data[0] if type(data) == list else data or {}).get('attributes', {})
+
+def list_entities(server, entity_type, app='gfw', env='production', page_size=1000):
+    """Returns every {'id', 'attributes'} document of an entity type for an app and env, reading `page_size` per page."""
+    found, page, pages = [], 1, 1
+    while page <= pages:
+        r = requests.get(f'{server}/v1/{entity_type}?app={app}&env={env}&page[size]={page_size}&page[number]={page}')
+        r.raise_for_status()
+        response = r.json()
+        found += response.get('data', [])
+        pages = response.get('meta', {}).get('total-pages', 1)
+        page += 1
+    return found
+
+def updated_signature(attributes):
+    """
+    Returns the updatedAt values of a dataset and of its included children (vocabularies by their tags),
+    which tell whether a saved copy of the dataset is still current.
+    """
+    signature = [attributes.get('updatedAt', None)]
+    for key in ['layer', 'widget', 'metadata']:
+        signature += sorted([f"{c.get('id')}:{c.get('attributes', {}).get('updatedAt')}" for c in attributes.get(key, None) or []])
+    signature += sorted([f"{v.get('id')}:{v.get('attributes', {}).get('tags')}" for v in attributes.get('vocabulary', None) or []])
+    return signature
+
+def dedupe_strings(obj, memo=None, max_length=64):
+    """
+    Replaces repeated short strings in a decoded JSON document (application codes, env, provider, etc.)
+    with one shared copy, in place, and returns the document.
+    """
+    memo = {} if memo is None else memo
+    keys = obj.keys() if type(obj) == dict else range(len(obj))
+    for k in keys:
+        v = obj[k]
+        if type(v) == str and len(v) <= max_length:
+            obj[k] = memo.setdefault(v, v)
+        elif type(v) in [dict, list]:
+            dedupe_strings(v, memo=memo, max_length=max_length)
+    return obj
+
 def get_geojson_string(geom):
     coords = geom.get('coordinates', None)
     if coords and not any(isinstance(i, list) for i in coords[0]):
@@ -234,21 +425,74 @@ def get_geojson_string(geom):
     feat_col = {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {}, "geometry": geom}]}
     return json.dumps(feat_col)
 
+SERVER_FILTERS = ['connectorType', 'provider', 'status', 'published', 'protected', 'geoInfo', 'name', 'env', 'sort', 'vocabulary']
+CLIENT_FILTERS = ['updatedAt', 'hasLayer', 'hasWidget']
+
+def filter_value(v):
+    """Formats a filter value as a url-safe query parameter (lists are comma separated)."""
+    if type(v) in [list, tuple]:
+        return ','.join([filter_value(i) for i in v])
+    if type(v) == bool:
+        return str(v).lower()
+    return quote(str(v), safe=',-')
+
 def parse_filters(filter_objects):
-    filter_whitelist = ['connectorType', 'provider', 'status', 'published', 'protected', 'geoInfo']
+    """
+    Returns a query string of the filters which can be evaluated by the `/v1/dataset` endpoint.
+
+    Vocabulary filters are given as a {name: tags} dictionary, e.g. {'vocabulary': {'legacy': ['forest']}}.
+    Filters listed in CLIENT_FILTERS are skipped here and applied to the response by `match_filters`.
+    """
     return_string = ''
     error_string = ''
     if filter_objects:
         for k, v in filter_objects.items():
-            if k in filter_whitelist:
-                return_string += f'{k}={v}&'
-            else:
+            if k == 'vocabulary' and type(v) == dict:
+                for name, tags in v.items():
+                    return_string += f'vocabulary[{name}]={filter_value(tags)}&'
+            elif k in SERVER_FILTERS:
+                return_string += f'{k}={filter_value(v)}&'
+            elif k not in CLIENT_FILTERS:
                 error_string += f' {k},'
         if error_string:
             print(f'Unable to filter by{error_string[:-1]}.')
         return return_string
     return ''
 
+def match_filters(attributes, filter_objects):
+    """
+    Applies the filters the server is unable to evaluate to a set of dataset attributes.
+
+    `updatedAt` takes a (start, end) pair or a {'gte': start, 'lte': end} dictionary of ISO dates
+    (either bound may be None), or a single ISO date as the start; `hasLayer` and `hasWidget` take a bool.
+    """
+    if not filter_objects:
+        return True
+    for k, v in filter_objects.items():
+        if k == 'updatedAt' and v:
+            if type(v) == str:
+                start, end = v, None
+            elif type(v) == dict:
+                start, end = v.get('gte', None), v.get('lte', None)
+            elif type(v) in [list, tuple] and len(v) == 2:
+                start, end = v
+            else:
+                raise ValueError(f"[updatedAt={v}] Expected an ISO date, a (start, end) pair or a {{'gte', 'lte'}} dictionary.")
+            updated = attributes.get('updatedAt', None)
+            if not updated:
+                return False
+            if start and updated[:len(start)] < start:
+                return False
+            if end and updated[:len(end)] > end:
+                return False
+        elif k == 'hasLayer' and v is not None:
+            if bool(attributes.get('layer', None)) != v:
+                return False
+        elif k == 'hasWidget' and v is not None:
+            if bool(attributes.get('widget', None)) != v:
+                return False
+    return True
+
 def sldDump(sldObj):
     """
     Creates valid SldStyle string from an object.
@@ -393,3 +637,14 @@ def env_association(server='https://api.resourcewatch.org', app='gfw'):
             }]
             
     return links
+
+def link_index(links):
+    """
+    Indexes the links returned by env_association by both their staging and production layer ids.
+    """
+    index = {}
+    for link in links:
+        for key in ['staging_layer', 'production_layer']:
+            if link.get(key, None):
+                index[link[key]] = link
+    return index
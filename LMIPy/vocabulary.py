@@ -1,5 +1,5 @@
 import requests
-from .utils import html_box, nested_set
+from .utils import html_box, nested_set, create_entity, update_entity
 
 class Vocabulary:
     """
@@ -28,16 +28,27 @@ class Vocabulary:
         """
         Update the attributes of a Vocabulary object providing a RW-API token is supplied.
 
-        A single application string, name string and tags list must be specified within the `update_params` dictionary.
+        A name string and/or tags list may be specified within the `update_params` dictionary. The tags are
+        updated with a single request (the vocabulary is only deleted and re-created if its name changes), and
+        the Vocabulary object is updated in place and returned.
         """
-        from .dataset import Dataset
         if not token:
             raise ValueError(f'[token] API token required to update vocabulary.')
-        update_params['application'] = self.attributes.get('application', None)
-        ds_id = self.id
-        self.delete(token=token)
-        Dataset(id_hash=ds_id, server=self.server).add_vocabulary(vocab_params=update_params, token=token)
-        return Dataset(id_hash=ds_id, server=self.server).vocabulary
+        if not update_params:
+            raise ValueError(f'[update_params=None] Must specify update parameters.')
+        name = self.attributes.get('name', None)
+        attributes = {
+            'application': self.attributes.get('application', None),
+            'name': update_params.get('name', name),
+            'tags': update_params.get('tags', self.attributes.get('tags', []))
+        }
+        if attributes['name'] == name:
+            update_entity(self.server, 'vocabulary', name, attributes, token, dataset_id=self.id)
+        else:
+            self.delete(token=token)
+            create_entity(self.server, 'vocabulary', attributes, token, dataset_id=self.id)
+        self.attributes = {**self.attributes, **attributes}
+        return self
 
     def delete(self, token=None):
         """
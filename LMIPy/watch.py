@@ -0,0 +1,156 @@
+import asyncio
+import requests
+from time import sleep
+from .utils import list_entities
+
+class Watcher:
+    """
+    Watches the datasets and layers of an app for changes, and emits 'created', 'updated' and 'deleted' events.
+
+    The first poll lists the current entities as a baseline. Each later poll requests the first page of
+    entities sorted by -updatedAt, with the ETag and Last-Modified of the previous response so an unchanged
+    catalogue costs a single 304 response, and reads further pages only while they hold entities newer than
+    the high-water mark. Deletions are found when the total count of entities drops below the number known,
+    by listing the ids of that entity type once.
+
+    Events are dictionaries {'event', 'type', 'id', 'updatedAt', 'attributes'}, returned by poll(), passed to
+    the callbacks registered with on(), and yielded by the async iterator events().
+
+    Parameters
+    ----------
+    server: str
+        A string of a server to watch.
+    app: str
+        The application of the entities to watch.
+    entity_types: list
+        The entity types to watch: 'dataset' and/or 'layer'.
+    env: str
+        The environment of the entities to watch.
+    interval: int
+        The number of seconds between polls.
+    page_size: int
+        The number of entities requested per poll.
+    """
+    def __init__(self, server='https://api.resourcewatch.org', app='gfw', entity_types=['dataset', 'layer'], env='production',
+                 interval=60, page_size=100):
+        self.type = 'Watcher'
+        self.server = server
+        self.app = app
+        self.entity_types = entity_types
+        self.env = env
+        self.interval = interval
+        self.page_size = page_size
+        self.callbacks = []
+        self.known = {entity_type: None for entity_type in entity_types}
+        self.marks = {entity_type: None for entity_type in entity_types}
+        self.validators = {entity_type: {} for entity_type in entity_types}
+
+    def __repr__(self):
+        return self.__str__()
+
+    def __str__(self):
+        return f"Watcher {self.server} ({self.app}, {self.env}: {', '.join(self.entity_types)})"
+
+    def on(self, callback):
+        """Registers a callback, which is called with every event."""
+        self.callbacks.append(callback)
+        return self
+
+    def url(self, entity_type, page=1, page_size=None):
+        return (f'{self.server}/v1/{entity_type}?app={self.app}&env={self.env}&sort=-updatedAt'
+                f'&page[size]={page_size or self.page_size}&page[number]={page}')
+
+    def list_all(self, entity_type):
+        """Returns {id: attributes} of every entity of a type (see utils.list_entities)."""
+        return {item['id']: item['attributes'] for item in list_entities(self.server, entity_type, app=self.app, env=self.env)}
+
+    def baseline(self, entity_type, entities):
+        """Sets the known entities of a type and the high-water mark, without emitting events."""
+        self.known[entity_type] = {entity_id: atts.get('updatedAt', None) for entity_id, atts in entities.items()}
+        self.marks[entity_type] = max([u for u in self.known[entity_type].values() if u] or [None], key=lambda u: u or '')
+
+    def apply_page(self, entity_type, items):
+        """
+        Returns the events for a page of entities sorted by -updatedAt, and whether the page reached the
+        high-water mark (so no further pages need to be read).
+        """
+        known, mark = self.known[entity_type], self.marks[entity_type] or ''
+        events = []
+        for item in items:
+            updated = item['attributes'].get('updatedAt', None) or ''
+            if updated <= mark:
+                return events, True
+            if known.get(item['id'], None) != updated:
+                event = 'updated' if item['id'] in known else 'created'
+                events.append({'event': event, 'type': entity_type, 'id': item['id'], 'updatedAt': updated, 'attributes': item['attributes']})
+                known[item['id']] = updated
+        return events, False
+
+    def reconcile(self, entity_type, ids):
+        """Returns 'deleted' events for the known entities of a type which are not among `ids`."""
+        known = self.known[entity_type]
+        events = [{'event': 'deleted', 'type': entity_type, 'id': entity_id, 'updatedAt': known[entity_id], 'attributes': None}
+                  for entity_id in sorted(set(known) - set(ids))]
+        for event in events:
+            del known[event['id']]
+        return events
+
+    def poll(self):
+        """Checks every entity type for changes since the last poll, and returns (and dispatches) the events."""
+        events = []
+        for entity_type in self.entity_types:
+            if self.known[entity_type] is None:
+                self.baseline(entity_type, self.list_all(entity_type))
+                continue
+            validators = self.validators[entity_type]
+            headers = {}
+            if validators.get('ETag', None):
+                headers['If-None-Match'] = validators['ETag']
+            if validators.get('Last-Modified', None):
+                headers['If-Modified-Since'] = validators['Last-Modified']
+            r = requests.get(self.url(entity_type), headers=headers)
+            if r.status_code == 304:
+                continue
+            r.raise_for_status()
+            self.validators[entity_type] = {k: r.headers.get(k, None) for k in ['ETag', 'Last-Modified']}
+            response = r.json()
+            page, pages = 1, response.get('meta', {}).get('total-pages', 1)
+            while True:
+                found, reached = self.apply_page(entity_type, response.get('data', []))
+                events += found
+                if reached or page >= pages:
+                    break
+                page += 1
+                r = requests.get(self.url(entity_type, page=page))
+                r.raise_for_status()
+                response = r.json()
+            updates = [e['updatedAt'] for e in events if e['type'] == entity_type]
+            if updates:
+                self.marks[entity_type] = max(updates + [self.marks[entity_type] or ''])
+            total = response.get('meta', {}).get('total-items', None)
+            if total is not None and total < len(self.known[entity_type]):
+                events += self.reconcile(entity_type, self.list_all(entity_type).keys())
+        for event in events:
+            for callback in self.callbacks:
+                callback(event)
+        return events
+
+    def watch(self, polls=None):
+        """Polls every `interval` seconds, dispatching events to the callbacks, `polls` times or forever."""
+        n = 0
+        while polls is None or n < polls:
+            self.poll()
+            n += 1
+            if polls is None or n < polls:
+                sleep(self.interval)
+
+    async def events(self):
+        """
+        Asynchronously yields events, polling every `interval` seconds in the default executor so the
+        event loop is not blocked.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            for event in await loop.run_in_executor(None, self.poll):
+                yield event
+            await asyncio.sleep(self.interval)
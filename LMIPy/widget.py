@@ -1,7 +1,8 @@
 import requests
 import random
 import json
-from .utils import html_box, nested_set
+from .utils import html_box, nested_set, dataset_record
+from .backup import backup_path, open_backup
 
 
 class Vocabulary:
@@ -172,14 +173,16 @@ class Widget:
             print(f'Widget deleted.')
         return None
 
-    def save(self, path=None):
+    def save(self, path=None, archive=False, versioned=False):
         """
-        Construct dataset json and save to local path in a date-referenced folder
+        Construct the parent dataset json and save to local path in a date-referenced folder
+
+        The parent dataset is fetched once, with its widgets. See Dataset.save for `archive` and `versioned`.
         """
-        from .dataset import Dataset
-        ds_id = self.attributes['dataset']
-        ds = Dataset(id_hash=ds_id, server=self.server)
-        ds.save(path=path)
+        path = backup_path(path, archive=archive, versioned=versioned)
+        with open_backup(path) as backup:
+            backup.append(dataset_record(self.server, self.attributes['dataset']))
+        print('Save complete!')
 
     def merge(self, token=None, target_widget=None, target_widget_id=None, target_server='https://api.resourcewatch.org', key_whitelist=[], force=False):
         """
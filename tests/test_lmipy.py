@@ -2,7 +2,7 @@ import pytest
 import random
 import os
 import os.path
-from LMIPy import Dataset, Table, Collection, Layer, Metadata, Vocabulary, Widget, Image, ImageCollection, Geometry, utils
+from LMIPy import Dataset, Table, Collection, Layer, Metadata, Vocabulary, Widget, Image, ImageCollection, Geometry, Archive, Store, Sync, Job, Watcher, utils, catalogue, bulk
 
 try:
     API_TOKEN = os.environ.get("API_TOKEN", None)
@@ -27,6 +27,18 @@ def test_search_collection_filters():
     col = Collection(search='forest', object_type=['layer'], filters={'provider': 'gee'}, app=['gfw'])
     assert len(col) > 1
 
+def test_search_collection_servers():
+    """Search production RW and staging GFW servers at once"""
+    servers = ['https://api.resourcewatch.org', 'https://staging-api.globalforestwatch.org']
+    col = Collection(search='forest', object_type=['dataset'], app=['gfw'], server=servers)
+    assert len(col) > 1
+    assert set([c['server'] for c in col]) <= set(servers)
+
+def test_collection_map():
+    col = Collection(search='template', object_type=['dataset'], app=['gfw'], env='staging', limit=3)
+    ids = col.map(lambda ds: ds.id, workers=3)
+    assert ids == [c['id'] for c in col]
+
 def test_collection_save():
     col = Collection(search='template', object_type=['dataset'], app=['gfw'], env='staging')
     ds = col[0]
@@ -37,6 +49,194 @@ def test_collection_save():
     _ = [os.remove(save_path+f"/{f}") for f in os.listdir(save_path)] 
     os.rmdir(save_path)  
 
+### Offline Collection fixture
+
+SERVER = 'https://api.resourcewatch.org'
+
+def offline_collection():
+    """A Collection built from search-style records, without any requests"""
+    layer = {'id': 'l-1', 'type': 'layer', 'attributes': {'name': 'Tree cover loss', 'dataset': 'd-1', 'env': 'production',
+             'application': ['gfw'], 'provider': 'gee', 'updatedAt': '2019-03-01T10:00:00.000Z', 'layerConfig': {'type': 'tileLayer'}}}
+    widget = {'id': 'w-1', 'type': 'widget', 'attributes': {'name': 'Loss chart', 'dataset': 'd-1', 'env': 'production',
+              'application': ['gfw'], 'widgetConfig': {'type': 'chart'}, 'updatedAt': '2019-03-02T10:00:00.000Z'}}
+    dataset = {'id': 'd-1', 'type': 'dataset', 'attributes': {'name': 'Tree cover loss', 'env': 'production',
+               'application': ['gfw'], 'provider': 'gee', 'connectorType': 'rest', 'tableName': 'projects/loss',
+               'published': True, 'updatedAt': '2019-03-01T09:00:00.000Z', 'layer': [layer], 'widget': [widget],
+               'metadata': [], 'vocabulary': []}}
+    table = {'id': 'd-2', 'type': 'dataset', 'attributes': {'name': 'Forest table', 'env': 'staging',
+             'application': ['rw'], 'provider': 'csv', 'connectorType': 'document', 'tableName': 'data',
+             'connectorUrl': 'https://example.org/forest.csv', 'published': False,
+             'updatedAt': '2019-02-01T09:00:00.000Z', 'layer': [], 'widget': [], 'metadata': [], 'vocabulary': []}}
+    resources = [
+        {'type': 'Dataset', 'id': 'd-1', 'attributes': dataset['attributes'], 'server': SERVER},
+        {'type': 'Table', 'id': 'd-2', 'attributes': table['attributes'], 'server': SERVER},
+        {'type': 'Layer', 'id': 'l-1', 'attributes': layer['attributes'], 'server': SERVER},
+        {'type': 'Widget', 'id': 'w-1', 'attributes': widget['attributes'], 'server': SERVER}
+    ]
+    return Collection(attributes={'resources': resources, 'name': 'Offline', 'application': None, 'ownerId': None})
+
+def test_collection_sort_filter():
+    col = offline_collection()
+    col.filters = {'sort': '-updatedAt'}
+    assert [c['id'] for c in col.order_results(list(col))] == ['w-1', 'l-1', 'd-1', 'd-2']
+
+def test_collection_to_dataframe():
+    col = offline_collection()
+    df = col.to_dataframe()
+    assert len(df) == 4
+    assert 'layerConfig.type' in df.columns
+    assert 'layer' not in df.columns
+    assert list(df['dataset']) == ['d-1', 'd-2', 'd-1', 'd-1']
+    df = col.to_dataframe(columns=['id', 'type', 'provider'])
+    assert list(df.columns) == ['id', 'type', 'provider']
+
+def test_collection_save_offline(tmp_path, capsys):
+    col = offline_collection()
+    save_path = str(tmp_path / 'backup')
+    assert col.save(path=save_path, workers=2) is None
+    assert sorted(os.listdir(save_path)) == ['d-1.json', 'd-2.json']
+    assert 'Saved 2 dataset(s), skipped 0 unchanged.' in capsys.readouterr().out
+    col.save(path=save_path, workers=2)
+    assert 'Saved 0 dataset(s), skipped 2 unchanged.' in capsys.readouterr().out
+
+def test_collection_save_archive(tmp_path, capsys):
+    col = offline_collection()
+    save_path = str(tmp_path / 'backup.lmi')
+    col.save(path=save_path, workers=2)
+    archive = Archive(save_path)
+    assert sorted(archive.ids()) == ['d-1', 'd-2']
+    assert archive['d-1']['attributes']['layer'][0]['id'] == 'l-1'
+    col.save(path=save_path, workers=2)
+    assert 'Saved 0 dataset(s), skipped 2 unchanged.' in capsys.readouterr().out
+
+def test_collection_save_versioned(tmp_path):
+    col = offline_collection()
+    save_path = str(tmp_path / 'backup.lmistore')
+    col.save(path=save_path, workers=2)
+    blobs = sum([len(files) for _, _, files in os.walk(f'{save_path}/blobs')])
+    assert blobs == 4
+    col.attributes['resources'][1]['attributes'].update({'name': 'Forest table v2', 'updatedAt': '2019-04-01T09:00:00.000Z'})
+    col.save(path=save_path, workers=2)
+    store = Store(save_path)
+    assert len(store.snapshots()) == 2
+    assert sum([len(files) for _, _, files in os.walk(f'{save_path}/blobs')]) == blobs + 1
+    assert store['d-2']['attributes']['name'] == 'Forest table v2'
+    assert store['d-1']['attributes']['widget'][0]['id'] == 'w-1'
+    first = Collection.load(save_path, snapshot=store.snapshots()[0])
+    assert [c['attributes']['name'] for c in first if c['id'] == 'd-2'] == ['Forest table']
+    del col.attributes['resources'][1]
+    col.save(path=save_path, workers=2)
+    store = Store(save_path)
+    assert len(store.snapshots()) == 3
+    assert store.ids() == ['d-1']
+    removed = catalogue.diff(Store(save_path, snapshot=store.snapshots()[1]), save_path)['removed']
+    assert [(r['type'], r['id']) for r in removed] == [('dataset', 'd-2')]
+
+def test_collection_save_versioned_failure(tmp_path):
+    save_path = str(tmp_path / 'backup.lmistore')
+    offline_collection().save(path=save_path, workers=2)
+    col = offline_collection()
+    col.attributes['resources'][0]['attributes']['updatedAt'] = '2019-05-01T09:00:00.000Z'
+    del col.attributes['resources'][1]['attributes']['layer']
+    assert col.save(path=save_path, workers=2) == ['d-2']
+    store = Store(save_path)
+    assert len(store.snapshots()) == 2
+    assert store.ids() == ['d-1', 'd-2']
+    assert catalogue.diff(Store(save_path, snapshot=store.snapshots()[0]), save_path)['removed'] == []
+
+def test_backup_path_extensions(tmp_path):
+    from LMIPy.backup import backup_path
+    path = backup_path(str(tmp_path / 'bk'), archive=True)
+    assert path.endswith('bk.lmi')
+    assert not os.path.exists(path)
+    assert backup_path(str(tmp_path / 'bk.lmi'), archive=True).endswith('bk.lmi')
+    assert backup_path(str(tmp_path / 'bk'), versioned=True).endswith('bk.lmistore')
+    with pytest.raises(FileNotFoundError):
+        Collection.load(str(tmp_path / 'missing'))
+    assert not os.path.exists(tmp_path / 'missing')
+
+def test_collection_save_servers(tmp_path):
+    col = offline_collection()
+    other = 'https://staging-api.resourcewatch.org'
+    col.attributes['resources'][1]['server'] = other
+    save_path = str(tmp_path / 'backup')
+    col.save(path=save_path, workers=2)
+    servers = {c['id']: c['server'] for c in Collection.load(save_path)}
+    assert (servers['d-1'], servers['d-2']) == (SERVER, other)
+
+def test_collection_load(tmp_path):
+    save_path = str(tmp_path / 'backup.lmi')
+    offline_collection().save(path=save_path, workers=2)
+    col = Collection.load(save_path)
+    assert sorted([(c['type'], c['id']) for c in col]) == [('Dataset', 'd-1'), ('Layer', 'l-1'), ('Table', 'd-2'), ('Widget', 'w-1')]
+    assert [c['id'] for c in Collection.load(save_path, object_type=['layer'])] == ['l-1']
+
+def test_job_resume(tmp_path):
+    calls = []
+    def flaky(n):
+        calls.append(n)
+        if n == 3 and calls.count(3) == 1:
+            raise ValueError('network blip')
+        if n == 4:
+            raise ValueError('always fails')
+        return n * 10
+    checkpoint = str(tmp_path / 'job.sqlite')
+    job = Job(checkpoint, name='test')
+    results = job.run(flaky, [1, 2, 3, 4], retries=1, backoff=0, progress=False)
+    assert [r for r, e in results] == [10, 20, 30, None]
+    assert job.status() == {'done': 3, 'failed': 1}
+    job.close()
+    calls.clear()
+    results = Job(checkpoint, name='test').run(flaky, [1, 2, 3, 4], retries=0, progress=False)
+    assert calls == [4]
+    assert [r for r, e in results] == [10, 20, 30, None]
+
+def test_collection_save_checkpoint(tmp_path, capsys):
+    import json
+    save_path, checkpoint = str(tmp_path / 'backup'), str(tmp_path / 'save.sqlite')
+    col = offline_collection()
+    col.save(path=save_path, workers=2, checkpoint=checkpoint)
+    col.attributes['resources'][1]['attributes'].update({'name': 'Forest table v2', 'updatedAt': '2019-04-01T09:00:00.000Z'})
+    col.save(path=save_path, workers=2, checkpoint=checkpoint)
+    out = capsys.readouterr().out
+    assert 'Resuming job' not in out
+    assert 'Saved 1 dataset(s), skipped 1 unchanged.' in out
+    with open(f'{save_path}/d-2.json') as fp:
+        assert json.load(fp)['attributes']['name'] == 'Forest table v2'
+    resume_path = str(tmp_path / 'resume')
+    with Job(checkpoint, name=f'save {resume_path}') as job:
+        job.record(f'{SERVER}/d-1', 'done', result=True)
+        job.record(f'{SERVER}/d-2', 'pending')
+    col.save(path=resume_path, workers=2, checkpoint=checkpoint)
+    out = capsys.readouterr().out
+    assert 'Resuming job' in out
+    assert 'Saved 1 dataset(s), skipped 0 unchanged.' in out
+    assert '1 dataset(s) were already saved by an earlier run.' in out
+    assert sorted(os.listdir(resume_path)) == ['d-2.json']
+    assert Job(checkpoint, name=f'save {resume_path}').status() == {}
+
+def test_collection_resource_payloads():
+    col = offline_collection()
+    assert col.resource_payloads(list(col)) == [{'type': 'dataset', 'id': 'd-1'}, {'type': 'dataset', 'id': 'd-2'},
+                                                {'type': 'layer', 'id': 'l-1'}, {'type': 'widget', 'id': 'w-1'}]
+    with pytest.raises(ValueError):
+        col.resource_payloads(['d-1'])
+
+def test_collection_repr_without_requests():
+    col = offline_collection()
+    col.repr_limit = 2
+    html = col._repr_html_()
+    assert html.count("class='item_container'") == 2
+    assert 'and 2 more' in html
+    assert col.html(start=2).count("class='item_container'") == 2
+    assert repr(col).endswith('... and 2 more]')
+
+def test_collection_nested_iteration():
+    col = offline_collection()
+    pairs = [(a['id'], b['id']) for a in col for b in col]
+    assert len(pairs) == 16
+    assert len(list(col)) == 4
+
 #----- Dataset Tests -----#
 
 def test_create_dataset():
@@ -353,8 +553,9 @@ def test_update_vocab():
         'tags': ['forestChange', 'treeCoverChange']
     }
     updated_v = v.update(update_params=payload, token=API_TOKEN)
-    assert updated_v[0].attributes['name'] == 'categoryTab'
-    assert updated_v[0].attributes['tags'] == ['forestChange', 'treeCoverChange']
+    assert updated_v is v
+    assert updated_v.attributes['name'] == 'categoryTab'
+    assert updated_v.attributes['tags'] == ['forestChange', 'treeCoverChange']
 
 #----- Meta Tests -----#
 
@@ -395,7 +596,7 @@ def test_update_meta():
         'isLossLayer': False,
         'name': 'Template Layer'},
     'language': 'en'}
-    m.update(update_params=payload, token=API_TOKEN)
+    assert m.update(update_params=payload, token=API_TOKEN) is m
     ds = Dataset(id_hash='7cf3fab2-3fbe-4980-b572-712207b2c8c7')
     updated_m = ds.metadata[0]
     assert updated_m.attributes['info']['description'] == 'TEST'
@@ -488,3 +689,194 @@ def test_sld_functions():
     sld_str = utils.sldDump(sld_obj)
     assert sld_str == '<RasterSymbolizer> <ColorMap type="ramp" extended="false"> <ColorMapEntry color="#F8EBFF" quantity="-40" /> + <ColorMapEntry color="#ECCAFC" quantity="-20.667" /> + <ColorMapEntry color="#DFA4FF" quantity="-14.667" /> + <ColorMapEntry color="#C26DFE" quantity="-10" /> + <ColorMapEntry color="#9D36F7" quantity="-3.333" /> + <ColorMapEntry color="#6D00E1" quantity="-0.667" /> + <ColorMapEntry color="#3C00AB" /> + </ColorMap> </RasterSymbolizer>'
     assert utils.sldParse(sld_str) == test_sld
+
+def test_parse_filters():
+    filters = {
+        'provider': 'gee',
+        'published': True,
+        'sort': '-updatedAt',
+        'vocabulary': {'legacy': ['forest', 'loss']},
+        'updatedAt': ('2019-01-01', None)
+    }
+    assert utils.parse_filters(filters) == 'provider=gee&published=true&sort=-updatedAt&vocabulary[legacy]=forest,loss&'
+
+def test_match_filters():
+    atts = {'updatedAt': '2019-03-01T10:00:00.000Z', 'layer': [{'id': 'a'}], 'widget': []}
+    assert utils.match_filters(atts, {'updatedAt': ('2019-01-01', '2019-03-01')})
+    assert not utils.match_filters(atts, {'updatedAt': {'gte': '2019-03-02'}})
+    assert utils.match_filters(atts, {'updatedAt': '2019-01-01'})
+    assert not utils.match_filters(atts, {'updatedAt': '2019-03-02'})
+    with pytest.raises(ValueError):
+        utils.match_filters(atts, {'updatedAt': ['2019-01-01']})
+    assert utils.match_filters(atts, {'hasLayer': True, 'hasWidget': False})
+    assert not utils.match_filters(atts, {'hasWidget': True})
+
+#----- Backup Tests -----#
+
+def test_archive_append_and_read(tmp_path):
+    path = str(tmp_path / 'test.lmi')
+    with Archive(path) as archive:
+        archive.append({'id': 'a', 'type': 'dataset', 'attributes': {'name': 'A', 'updatedAt': '1'}})
+        archive.append({'id': 'b', 'type': 'dataset', 'attributes': {'name': 'B', 'updatedAt': '1'}})
+    with Archive(path) as archive:
+        archive.append({'id': 'a', 'type': 'dataset', 'attributes': {'name': 'A2', 'updatedAt': '2'}})
+    archive = Archive(path)
+    assert len(archive) == 2
+    assert archive['a']['attributes']['name'] == 'A2'
+    assert [r['id'] for r in archive] == ['b', 'a']
+
+def test_archive_recovers_unclosed_index(tmp_path):
+    path = str(tmp_path / 'test.lmi')
+    archive = Archive(path)
+    archive.append({'id': 'a', 'type': 'dataset', 'attributes': {'name': 'A'}})
+    archive.fp.flush()
+    assert Archive(path)['a']['attributes']['name'] == 'A'
+    archive.close()
+
+def test_run_concurrently_order_and_errors():
+    def invert(x):
+        return 1 / x
+    results = utils.run_concurrently(invert, [1, 2, 0, 4], workers=3, rate_limit=100, progress=False)
+    assert [r for r, e in results] == [1, 0.5, None, 0.25]
+    assert isinstance(results[2][1], ZeroDivisionError)
+
+#----- Catalogue Tests -----#
+
+def test_catalogue_diff(tmp_path):
+    save_path = str(tmp_path / 'backup')
+    offline_collection().save(path=save_path, workers=2)
+    col = offline_collection()
+    col.attributes['resources'][0]['attributes']['layer'][0]['attributes']['layerConfig'] = {'type': 'vector'}
+    col.attributes['resources'][1]['attributes']['widget'] = [{'id': 'w-2', 'type': 'widget', 'attributes': {'name': 'New'}}]
+    del col.attributes['resources'][3]
+    col.attributes['resources'][0]['attributes']['widget'] = []
+    difs = col.diff(save_path, ignore=['updatedAt'])
+    assert difs['added'] == [{'type': 'widget', 'id': 'w-2', 'name': 'New'}]
+    assert difs['removed'] == [{'type': 'widget', 'id': 'w-1', 'name': 'Loss chart'}]
+    assert difs['changed'] == [{'type': 'layer', 'id': 'l-1', 'name': 'Tree cover loss',
+                                'fields': {'layerConfig.type': ['tileLayer', 'vector']}}]
+
+def test_collection_facets(tmp_path):
+    col = offline_collection()
+    counts = col.facets(['type', 'env', 'application'])
+    assert counts['type'] == {'Dataset': 1, 'Table': 1, 'Layer': 1, 'Widget': 1}
+    assert counts['env'] == {'production': 3, 'staging': 1}
+    assert counts['application'] == {'gfw': 3, 'rw': 1}
+    save_path = str(tmp_path / 'backup.lmi')
+    col.save(path=save_path, workers=2)
+    loaded = Collection.load(save_path, object_type=['dataset', 'table'])
+    assert loaded.facets(['provider', 'published']) == {'provider': {'gee': 1, 'csv': 1}, 'published': {True: 1, False: 1}}
+    del loaded.attributes['resources'][1]
+    assert loaded.facets(['provider']) == {'provider': {'gee': 1}}
+
+def test_catalogue_graph():
+    col = offline_collection()
+    col.attributes['resources'][0]['attributes']['metadata'] = [
+        {'id': 'm-1', 'type': 'metadata', 'attributes': {'dataset': 'd-1', 'resource': {'id': 'd-1', 'type': 'dataset'}}}]
+    graph = col.graph(collections=[{'id': 'c-1', 'attributes': {'resources': [{'type': 'layer', 'id': 'l-1'}]}}])
+    assert graph.neighbours('d-1', direction='out') == ['l-1', 'm-1', 'w-1']
+    assert graph.neighbours('l-1', direction='in') == ['c-1', 'd-1']
+    assert graph.neighbours('d-1', entity_type='widget') == ['w-1']
+    assert graph.impact('d-1') == {'collection': ['c-1'], 'layer': ['l-1'], 'metadata': ['m-1'], 'widget': ['w-1']}
+
+def test_catalogue_duplicate_sources():
+    col = offline_collection()
+    copy = {**col.attributes['resources'][0]['attributes'], 'name': 'Tree cover loss CLONE', 'layer': [], 'widget': [],
+            'tableName': ' Projects/Loss '}
+    col.attributes['resources'].append({'type': 'Dataset', 'id': 'd-3', 'attributes': copy, 'server': SERVER})
+    duplicates = col.duplicates()
+    assert len(duplicates) == 1
+    assert duplicates[0]['tableName'] == 'projects/loss'
+    assert [(d['id'], d['layers'], d['widgets']) for d in duplicates[0]['datasets']] == [('d-1', 1, 1), ('d-3', 0, 0)]
+
+#----- Bulk Tests -----#
+
+def test_layer_health_check():
+    col = Collection(search='forest', object_type=['layer'], app=['gfw'], limit=10)
+    df = col.health_check(only_broken=False)
+    assert len(df) == len(col)
+    assert set(df['status']) <= {'ok', 'broken', 'unsupported'}
+
+def test_bulk_update_dry_run(capsys):
+    col = offline_collection()
+    col.attributes['resources'][2]['attributes']['protected'] = True
+    df = col.bulk_update({'application': lambda apps: sorted(set(apps) | {'gfw'}), 'layerConfig.type': lambda t: t.upper()})
+    assert list(df['status']) == ['unchanged', 'pending', 'protected', 'unchanged']
+    assert df['payload'][1] == {'application': ['gfw', 'rw']}
+    assert df['fields'][2] == ['layerConfig']
+    assert col.attributes['resources'][2]['attributes']['layerConfig'] == {'type': 'tileLayer'}
+    assert '1 to update, 2 unchanged, 1 protected (skipped), 0 failed.' in capsys.readouterr().out
+    assert bulk.patch_payload({'name': 'x', 'layerConfig': {}}, {'description': 'new', 'interactionConfig.output': []}, 'layer') == \
+        {'description': 'new', 'interactionConfig': {'output': []}}
+    df = col.bulk_update({'layerConfig.body.url': lambda u: u.replace('old', 'new')})
+    assert list(df['status']) == ['unchanged', 'unchanged', 'failed', 'unchanged']
+    assert df['error'][2].startswith('AttributeError')
+
+def test_cascade_plan():
+    col = offline_collection()
+    records = [{'id': item['id'], 'type': 'dataset', 'attributes': item['attributes']} for item in col if item['type'] in ['Dataset', 'Table']]
+    collections = [{'id': 'c-1', 'attributes': {'resources': [{'id': 'd-1', 'type': 'dataset'}, {'id': 'l-1', 'type': 'layer'}]}}]
+    steps = bulk.cascade_plan(records, collections=collections)
+    assert [(s['type'], s['id']) for s in steps] == [('membership', 'c-1/d-1'), ('membership', 'c-1/l-1'), ('widget', 'w-1'),
+                                                     ('layer', 'l-1'), ('dataset', 'd-1'), ('dataset', 'd-2')]
+    assert steps[1]['path'] == '/v1/collection/c-1/resource/layer/l-1'
+    assert steps[3]['path'] == '/v1/dataset/d-1/layer/l-1'
+    assert bulk.protected_datasets(records) == set()
+    records[0]['attributes']['layer'][0]['attributes']['protected'] = True
+    records[1]['attributes']['protected'] = True
+    assert bulk.protected_datasets(records) == {'d-1', 'd-2'}
+
+def test_sync_plan(tmp_path):
+    import json
+    map_path = str(tmp_path / 'sync.json')
+    col = offline_collection()
+    sync = Sync(col, 'https://example.org', path=map_path)
+    plan = sync.plan()
+    assert [(o['action'], o['type'], o['id']) for o in plan[:2]] == [('create', 'dataset', 'd-1'), ('create', 'dataset', 'd-2')]
+    assert sorted([o['id'] for o in plan[2:]]) == ['l-1', 'w-1']
+    sync.map = {f"{o['type']}/{o['id']}": {'id': o['id'] + '-t', 'digest': catalogue.digest(o['payload']), 'payload': o['payload']} for o in plan}
+    sync.save()
+    col.attributes['resources'][2]['attributes']['layerConfig'] = {'type': 'vector'}
+    plan = Sync(col, 'https://example.org', path=map_path).plan()
+    assert [(o['action'], o['target'], o['fields']) for o in plan if o['action'] != 'unchanged'] == [('update', 'l-1-t', ['layerConfig'])]
+
+def test_linked_layer_drift():
+    links = [{'metadata_id': 'm-1', 'production_layer': 'l-p', 'staging_layer': 'l-s', 'production_dataset': 'd-p', 'staging_dataset': 'd-s'}]
+    index = utils.link_index(links)
+    assert index['l-p'] is index['l-s']
+    staging = {'layerConfig': {'type': 'tileLayer', 'body': {'url': 'new'}}, 'legendConfig': {'type': 'basic'}}
+    production = {'layerConfig': {'type': 'tileLayer', 'body': {'url': 'old'}}, 'legendConfig': {'type': 'basic'}}
+    assert bulk.layer_drift(staging, production) == ['layerConfig.body.url']
+    assert bulk.layer_drift(staging, staging) == []
+
+def test_watcher_events():
+    watcher = Watcher(server=SERVER, entity_types=['layer'])
+    watcher.baseline('layer', {'l-1': {'updatedAt': '2019-03-01T10:00:00.000Z'}, 'l-2': {'updatedAt': '2019-03-02T10:00:00.000Z'}})
+    page = [{'id': 'l-3', 'attributes': {'updatedAt': '2019-03-04T10:00:00.000Z'}},
+            {'id': 'l-1', 'attributes': {'updatedAt': '2019-03-03T10:00:00.000Z'}},
+            {'id': 'l-2', 'attributes': {'updatedAt': '2019-03-02T10:00:00.000Z'}}]
+    events, reached = watcher.apply_page('layer', page)
+    assert [(e['event'], e['id']) for e in events] == [('created', 'l-3'), ('updated', 'l-1')]
+    assert reached
+    assert [(e['event'], e['id']) for e in watcher.reconcile('layer', ['l-1', 'l-3'])] == [('deleted', 'l-2')]
+    assert sorted(watcher.known['layer']) == ['l-1', 'l-3']
+
+def test_widget_collection_save(tmp_path):
+    col = offline_collection()
+    widgets = [{'id': item['id'], 'attributes': item['attributes']} for item in col if item['type'] == 'Widget']
+    save_path = str(tmp_path / 'widgets.lmi')
+    datasets = {item['id']: item['attributes'] for item in col if item['type'] in ['Dataset', 'Table']}
+    widget_col = bulk.widget_collection(widgets, server=SERVER)
+    assert [(c['type'], c['id']) for c in widget_col] == [('Widget', 'w-1')]
+    widget_col.attributes['resources'].append({'type': 'Dataset', 'id': 'd-1', 'attributes': datasets['d-1'], 'server': SERVER})
+    widget_col.save(path=save_path, workers=2)
+    archive = Archive(save_path)
+    assert archive.ids() == ['d-1']
+    assert archive['d-1']['attributes']['widget'][0]['attributes']['widgetConfig'] == {'type': 'chart'}
+
+def test_dedupe_strings():
+    import json
+    docs = json.loads('[{"env": "production", "application": ["gfw"]}, {"env": "production", "application": ["gfw"]}]')
+    utils.dedupe_strings(docs)
+    assert docs[0]['env'] is docs[1]['env']
+    assert docs[0]['application'][0] is docs[1]['application'][0]